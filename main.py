@@ -7,64 +7,36 @@ import json
 import threading
 import socket
 import re
-from io import BytesIO
+import functools
+import bisect
+import time
+import contextlib
+import itertools
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QGridLayout,
                              QPushButton, QLabel, QVBoxLayout, QFrame,
                              QStackedWidget, QMessageBox, QTableView, QHeaderView,
                              QLineEdit, QDateEdit, QComboBox, QHBoxLayout,
                              QFormLayout, QDialog, QDialogButtonBox, QTextEdit,
-                             QListWidget, QInputDialog, QFileDialog, QListWidgetItem,
-                             QTextBrowser, QGroupBox, QCheckBox)
-from PyQt5.QtCore import Qt, QSize, pyqtSignal, QAbstractTableModel, QDate, QTime, QDateTime, QThread, QRectF, QSizeF, QPointF
-from PyQt5.QtGui import QIcon, QFont, QImage, QPixmap, QPainter, QColor
-
-# --- Third-party library dependency check (will be handled in main) ---
-# --- Third-party library dependency check ---
-try:
-    import adif_io
-    import qrcode
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import mm
-    from reportlab.lib.utils import ImageReader
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
-    # --- 新增: PDF417 和 图形绘制支持 ---
-    #from reportlab.graphics.barcode.pdf417 import Pdf417
-    #from reportlab.graphics.barcode import createBarcodeDrawing 
-    #from reportlab.graphics.barcode.common import IBarCode
-    #from reportlab.graphics import renderPDF
-    #from reportlab.lib.units import mm as reportlab_mm
-    # ----------------------------------
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
-    # --- 新增 CID 字体支持 ---
-    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
-    # -------------------------
-    from PIL import Image
-    from PIL import Image
-    #from PIL.ImageQt import ImageQt
-    import fitz # PyMuPDF
-    import serial
-    import serial.tools.list_ports
-    
-    # --- 新增: Windows 打印支持 ---
-    import win32api
-    import win32print
-    # ----------------------------
-except ImportError as e:
-    print(f"Import Error: {e}")
-    pass
+                             QListWidget, QInputDialog, QFileDialog,
+                             QTextBrowser, QGroupBox, QCheckBox, QButtonGroup,
+                             QStyledItemDelegate, QStyleOptionViewItem, QStyle, QProgressDialog)
+from PyQt5.QtCore import Qt, QSize, pyqtSignal, QAbstractTableModel, QDate, QTime, QDateTime, QThread, QRectF, QSizeF, QPointF, QObject, QRunnable, QThreadPool, QTimer, QItemSelection, QItemSelectionModel, QModelIndex, QStringListModel
+from PyQt5.QtGui import QIcon, QFont, QImage, QPixmap, QPainter, QColor, QTextDocument, QValidator
+
+# --- 第三方库按需在使用处导入 (打印/串口/ADIF 功能首次使用时才加载)，依赖检查在 main 中进行 ---
 
 # --- Constants ---
 PRINTS_DIR = "print"# ✨ 新增：PDF 缓存文件目录
 DB_FILE = "database/qsl_manager.db"
 LOGBOOK_FILE = "logbook.adi"
-STYLE_SHEET_FILE = "assets/style.qss"
 CONFIG_FILE = "config.json"
 LABELS_DIR = "labels"
 ENG_FONT_FILE = "MapleMonoNL-Regular.ttf" # English Font
 ZH_FONT_FILE = "Cinese.ttf"              # Chinese Font
-MODES_LIST = ["", "AM", "ARDOP", "ATV", "C4FM", "CHIP", "CLO", "CW", "DIGITALVOICE", "DOMINO", "DSTAR", "FAX", "FM", "FSK441", "FT8", "FT4", "HELL", "JT4", "JT6M", "JT9", "JT44", "JT65", "MFSK", "MSK144", "MT63", "OLIVIA", "OPERA", "PACKET", "PAX", "PSK", "PSK2K", "Q15", "QRA64", "ROS", "RTTY", "RTTYM", "SSB", "SSTV", "THOR", "THRB", "V4", "V5", "VOI", "WINMOR", "WSPR", "AMSS", "ASCI", "PCW", "EYEBALL"]
+MODES_LIST = ("", "AM", "ARDOP", "ATV", "C4FM", "CHIP", "CLO", "CW", "DIGITALVOICE", "DOMINO", "DSTAR", "FAX", "FM", "FSK441", "FT8", "FT4", "HELL", "JT4", "JT6M", "JT9", "JT44", "JT65", "MFSK", "MSK144", "MT63", "OLIVIA", "OPERA", "PACKET", "PAX", "PSK", "PSK2K", "Q15", "QRA64", "ROS", "RTTY", "RTTYM", "SSB", "SSTV", "THOR", "THRB", "V4", "V5", "VOI", "WINMOR", "WSPR", "AMSS", "ASCI", "PCW", "EYEBALL")
+CJK_SEGMENT_RE = re.compile(r'[\u4e00-\u9fff]+|[^\u4e00-\u9fff]+') # 标签绘制时把文字切成中文 / 非中文段，分别使用中英文字体
+MODE_FILTER_ITEMS = ("全部模式",) + tuple(m for m in MODES_LIST if m) # 日志管理页的模式过滤下拉框
+BANDS_LIST = ("", "160m", "80m", "60m", "40m", "30m", "20m", "17m", "15m", "12m", "10m", "6m", "2m", "1.25m", "70cm", "33cm", "23cm", "13cm", "9cm", "5cm", "3cm", "1.2cm", "6mm", "4mm", "2.5mm", "2mm", "1mm", "N/A")
 FREQ_BAND_MAP = {
     (1.8, 2.0): "160m", (3.5, 4.0): "80m", (5.0, 5.6): "60m", (7.0, 7.3): "40m",
     (10.1, 10.15): "30m", (14.0, 14.35): "20m", (18.068, 18.168): "17m",
@@ -82,63 +54,192 @@ FREQ_BAND_MAP = {
     (134000, 136000): "2mm",
     (241000, 250000): "1mm" # Merged 241-248, 248-250
 }
+# 按下限排序的频段表，配合 bisect 做 O(log n) 频率 -> 频段查找 (各频段互不重叠)
+FREQ_BAND_STARTS = tuple(lower for lower, _ in sorted(FREQ_BAND_MAP))
+FREQ_BAND_ENDS = tuple((upper, FREQ_BAND_MAP[(lower, upper)]) for lower, upper in sorted(FREQ_BAND_MAP))
+# 导入 ADIF 时 logs 表字段与 ADIF 标签的对应关系 (comment / my_callsign 在导入逻辑中另行处理默认值)
+ADIF_IMPORT_FIELDS = (('station_callsign', 'CALL'), ('qso_date', 'QSO_DATE'), ('time_on', 'TIME_ON'), ('band', 'BAND'), ('band_rx', 'BAND_RX'),
+                      ('freq', 'FREQ'), ('freq_rx', 'FREQ_RX'), ('mode', 'MODE'), ('rst_sent', 'RST_SENT'), ('rst_rcvd', 'RST_RCVD'),
+                      ('comment', 'COMMENT'), ('my_callsign', 'OPERATOR'), ('submode', 'SUBMODE'), ('sat_name', 'SAT_NAME'), ('prop_mode', 'PROP_MODE'))
+# 合并重复日志时可从重复项补全到主日志的字段 (即 update_log_entry 会写回的列)
+MERGEABLE_LOG_FIELDS = ('station_callsign', 'qso_date', 'time_on', 'band', 'band_rx', 'freq', 'freq_rx', 'mode', 'rst_sent', 'rst_rcvd',
+                        'comment', 'submode', 'sat_name', 'prop_mode', 'qsl_sent_date', 'qsl_rcvd_date')
+# 数据库字段 -> ADIF 标签 (导出顺序)
+ADIF_EXPORT_MAPPING = (
+    ('station_callsign', 'CALL'), ('qso_date', 'QSO_DATE'), ('time_on', 'TIME_ON'), ('band', 'BAND'), ('band_rx', 'BAND_RX'),
+    ('mode', 'MODE'), ('submode', 'SUBMODE'), ('rst_sent', 'RST_SENT'), ('rst_rcvd', 'RST_RCVD'), ('freq', 'FREQ'),
+    ('freq_rx', 'FREQ_RX'), ('my_callsign', 'OPERATOR'), ('comment', 'COMMENT'), ('qsl_sent', 'QSL_SENT'),
+    ('qsl_rcvd', 'QSL_RCVD'), ('sat_name', 'SAT_NAME'), ('prop_mode', 'PROP_MODE')
+)
 
 
 # --- Configuration Manager ---
 class ConfigManager:
+    # 缓存已解析的配置，按文件 mtime 判断是否需要重新读取
+    _cache = None
+    _mtime = 0
+
+    @staticmethod
+    def _default_config():
+        return {"primary_callsign": "", "nfc_port": "", "nfc_baudrate": 9600}
+
     @staticmethod
     def load_config():
-        default_config = {"primary_callsign": "", "nfc_port": "", "nfc_baudrate": 9600}
-        if not os.path.exists(CONFIG_FILE): return default_config
+        try:
+            mtime = os.stat(CONFIG_FILE).st_mtime
+        except OSError:
+            ConfigManager._cache, ConfigManager._mtime = None, 0
+            return ConfigManager._default_config()
+        # 返回缓存的浅拷贝：调用方修改返回值不会改动缓存本身
+        if ConfigManager._cache is not None and mtime == ConfigManager._mtime:
+            return dict(ConfigManager._cache)
+        default_config = ConfigManager._default_config()
         try:
             with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
                 config = json.load(f)
                 # Ensure default keys exist
                 for key, value in default_config.items():
                     config.setdefault(key, value)
-                return config
         except (IOError, json.JSONDecodeError): return default_config
+        ConfigManager._cache, ConfigManager._mtime = config, mtime
+        return dict(config)
 
     @staticmethod
     def save_config(config_data):
+        """写入配置文件：成功返回 None，失败返回错误信息 (由调用方提示用户)。只有写入成功才更新缓存。"""
         try:
             os.makedirs(os.path.dirname(CONFIG_FILE) or '.', exist_ok=True)
             with open(CONFIG_FILE, 'w', encoding='utf-8') as f: json.dump(config_data, f, indent=4)
-        except IOError as e: print(f"Error saving config: {e}")
+            ConfigManager._cache, ConfigManager._mtime = dict(config_data), os.stat(CONFIG_FILE).st_mtime
+            return None
+        except (IOError, OSError) as e: return str(e)
 
     @staticmethod
     def get_config(key, default=""):
         return ConfigManager.load_config().get(key, default)
 
     @staticmethod
-    def set_config(key, value):
+    def set_config(key, value): return ConfigManager.set_configs({key: value})
+
+    @staticmethod
+    def set_configs(values):
+        """一次更新多个配置项，只写一次文件。返回值同 save_config：成功 (或无变化) 为 None，失败为错误信息。"""
         config = ConfigManager.load_config()
-        config[key] = value
-        ConfigManager.save_config(config)
+        # 值未变化时不重写配置文件 (例如每次写卡都会保存同一个串口设置)
+        changed = {key: value for key, value in values.items() if key not in config or config[key] != value}
+        if not changed: return None
+        # 在新字典上合并，写入失败时缓存仍保持文件中的旧值
+        return ConfigManager.save_config({**config, **changed})
 
 # --- ADIF Handler ---
 class ADIF_Handler:
+    @staticmethod
+    def read_adif_file(file_path):
+        """读取 ADIF (.adi) 文件，返回 QSO 列表。"""
+        with open(file_path, encoding="utf-8") as f: return ADIF_Handler.parse_adif(f.read())
+
+    @staticmethod
+    def parse_adif(text):
+        """
+        解析 ADIF 文本，返回 QSO 列表；每条 QSO 为普通 dict，键为大写字段名，值为字符串 (空值不保留)。
+        用 str.find 逐个定位 <字段名:长度[:类型]> 标签，按长度直接切出字段值，因此值中出现 < > 或 <eor> 也不会误判。
+        文件以 '<' 以外的字符开头时视为带文件头，跳过直到 <EOH>。
+        """
+        qsos = []; record = {}; has_empty = False; header_fields = set(); pos = 0; find = text.find
+        in_header = not text.startswith("<")
+        while True:
+            start = find("<", pos)
+            if start < 0: break
+            end = find(">", start + 1)
+            if end < 0: break
+            name, has_length, rest = text[start + 1:end].partition(":")
+            if not has_length:
+                marker = name.upper()
+                if marker == "EOR" and not in_header:
+                    # 空值字段只参与重复检查，不出现在结果中
+                    qsos.append({k: v for k, v in record.items() if v} if has_empty else record); record = {}; has_empty = False
+                elif marker == "EOH" and in_header: in_header = False
+                elif marker not in ("EOR", "EOH"): pos = start + 1; continue # 不是标签，从下一个字符继续查找
+                pos = end + 1; continue
+            length_text, has_type, data_type = rest.partition(":")
+            # 不是合法的字段标签 (例如正文中的 '<')：从下一个字符继续查找
+            if not (name.replace("_", "").isalnum() and length_text.isdecimal() and (data_type or not has_type)):
+                pos = start + 1; continue
+            value_end = end + 1 + int(length_text); value = text[end + 1:value_end]; pos = value_end
+            field = name.upper()
+            if in_header:
+                if field in header_fields: raise ValueError(f"ADIF 文件头中字段 {field} 重复。")
+                header_fields.add(field); continue
+            if field in record: raise ValueError(f"QSO 中字段 {field} 重复: \"{record[field]}\" / \"{value}\"")
+            record[field] = value
+            if not value: has_empty = True
+        if in_header: raise ValueError("ADIF 文件头缺少 <EOH> 标记。")
+        return qsos
+
     @staticmethod
     def qso_to_adif_record(qso_data: dict) -> str:
-        adif_str = ""
-        mapping = { 'station_callsign': 'CALL', 'qso_date': 'QSO_DATE', 'time_on': 'TIME_ON', 'band': 'BAND', 'band_rx': 'BAND_RX', 'mode': 'MODE', 'submode': 'SUBMODE', 'rst_sent': 'RST_SENT', 'rst_rcvd': 'RST_RCVD', 'freq': 'FREQ', 'freq_rx': 'FREQ_RX', 'my_callsign': 'OPERATOR', 'comment': 'COMMENT', 'qsl_sent': 'QSL_SENT', 'qsl_rcvd': 'QSL_RCVD', 'sat_name': 'SAT_NAME', 'prop_mode': 'PROP_MODE' }
-        for key, adif_tag in mapping.items():
-            value = qso_data.get(key)
-            if value: adif_str += f"<{adif_tag}:{len(str(value))}>{value} "
-        adif_str += "<EOR>\n\n"
-        return adif_str
+        get = qso_data.get
+        # 空值 (None / "" / 0) 不输出；str.join 对列表推导比生成器更快 (join 内部本就需要先物化序列)
+        return "".join([f"<{adif_tag}:{len(value)}>{value} " for key, adif_tag in ADIF_EXPORT_MAPPING
+                        for value in (str(get(key) or ""),) if value]) + "<EOR>\n\n"
 
     @staticmethod
     def append_to_logbook(adif_record: str):
+        ADIF_Handler.append_many_to_logbook([adif_record])
+
+    @staticmethod
+    def append_many_to_logbook(adif_records):
+        """一次打开文件写入多条记录，避免批量写入时逐条 open/close。"""
+        if not adif_records: return
         try:
-            with open(LOGBOOK_FILE, "a", encoding="utf-8") as f: f.write(adif_record)
+            with open(LOGBOOK_FILE, "a", encoding="utf-8") as f: f.write("".join(adif_records))
         except IOError as e: print(f"Error writing to logbook file: {e}")
 
+# --- Background Label Job ---
+class LabelJobSignals(QObject):
+    progress = pyqtSignal(int, int) # 已完成步骤数, 总步骤数 (每张标签绘制 + 预览各一步)
+    finished = pyqtSignal(str) # PDF 文件路径
+    failed = pyqtSignal(str)   # 错误信息
+
+class LabelJob(QRunnable):
+    """在线程池中生成标签 PDF，渲染 PNG 并写入打印目录。"""
+    active_jobs = set()
+    _pool = None
+
+    @staticmethod
+    def pool():
+        # PyMuPDF 不支持多线程并发渲染，使用单线程的专用线程池按顺序执行
+        if LabelJob._pool is None:
+            LabelJob._pool = QThreadPool()
+            LabelJob._pool.setMaxThreadCount(1)
+        return LabelJob._pool
+
+    def __init__(self, draw_func, pairs, fonts, pdf_path):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = LabelJobSignals()
+        self.draw_func = draw_func; self.pairs = pairs; self.fonts = fonts; self.pdf_path = pdf_path
+
+    def run(self):
+        try:
+            total = 2 * len(self.pairs); self.signals.progress.emit(0, total)
+            # 所有标签画在同一个画布上，直接写入打印文件，只打开/保存一次
+            first_pages = NewLayoutPrinter._build_labels(self.draw_func, self.pairs, self.fonts, self.pdf_path,
+                                                         lambda done: self.signals.progress.emit(done, total))
+            # 后台线程中不触碰界面，预览回调传 None；每张卡保存其第一页作为预览
+            NewLayoutPrinter._render_and_output_as_png([qsl_id for qsl_id, _ in self.pairs], self.pdf_path, None, first_pages,
+                                                       lambda done: self.signals.progress.emit(len(self.pairs) + done, total))
+            self.signals.finished.emit(self.pdf_path)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.signals.failed.emit(str(e))
+
 # --- New Fixed Layout Printer (Updated for 70x50mm Grid Layout) ---
 class NewLayoutPrinter:
     _eng_font = 'Helvetica'
     _zh_font = 'STSong-Light' # Default
-    _fonts_registered = False
+    _font_tuple = None # 首次注册后的 (英文字体名, 中文字体名)
 
     @staticmethod
     def _setup_fonts():
@@ -146,7 +247,11 @@ class NewLayoutPrinter:
         设置 ReportLab 使用的中英文混合字体。
         在 PyInstaller 打包环境下，使用 sys._MEIPASS 查找资源文件路径。
         仅使用基本的 TTFont 和 registerFontFamily 注册，兼容不支持 registerFontAlias 的旧版本。
+        每个进程只注册一次 (TTFont 需要完整解析字体文件)，之后直接返回缓存的字体名。
         """
+        if NewLayoutPrinter._font_tuple is not None: return NewLayoutPrinter._font_tuple
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
         # 确定资源文件的基本路径 (PyInstaller 兼容性)
         if getattr(sys, 'frozen', False):
             base_path = sys._MEIPASS
@@ -187,88 +292,115 @@ class NewLayoutPrinter:
             # 如果注册失败，回退到英文字体
             FONT_NAME_ZH = FONT_NAME_EN 
 
-        return FONT_NAME_EN, FONT_NAME_ZH
+        NewLayoutPrinter._font_tuple = (FONT_NAME_EN, FONT_NAME_ZH)
+        return NewLayoutPrinter._font_tuple
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _qr_image(qsl_id):
+        """生成 QSL ID 的二维码 PIL 图像，按 qsl_id 缓存，补打/重复生成时无需重新编码。"""
+        import qrcode
+        # 标签上二维码仅 10-12mm, 每模块 2px 已足够 (PDF 内按矢量尺寸缩放), 编码与 PNG 体积远小于默认 box_size=10
+        qr = qrcode.QRCode(version=2, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=2, border=0)
+        qr.add_data(qsl_id)
+        qr.make(fit=True)
+        return qr.make_image(fill_color="black", back_color="white").convert('RGB')
+
+    @staticmethod
+    def _qr_image_reader(qsl_id):
+        from reportlab.lib.utils import ImageReader
+        # ImageReader 直接接收 PIL 图像，省去 PNG 编码再解码
+        return ImageReader(NewLayoutPrinter._qr_image(qsl_id))
+
     @staticmethod
     def _print_file(file_path):
         """触发Windows默认打印机打印文件"""
         try:
+            import win32api
             # 使用 ShellExecute 调用关联的程序打印 (通常是默认的PDF阅读器)
             win32api.ShellExecute(0, "print", file_path, None, ".", 0)
         except Exception as e:
             print(f"Printing Error: {e}")
             # 如果 ShellExecute 失败，尝试直接提示用户
             try:
-                os.startfile(file_path, "print")
+                if sys.platform == "win32":
+                    os.startfile(file_path, "print")
+                else:
+                    # 非 Windows: 直接交给 CUPS 的 lp，参数列表传入 (不经过 shell)，不等待其返回
+                    import subprocess
+                    subprocess.Popen(["lp", file_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             except Exception as ex:
-                print(f"os.startfile failed: {ex}")
+                print(f"Fallback printing failed: {ex}")
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _string_width(text, font, size):
+        # 表头、字段名等相同文字在每张卡上重复绘制，宽度按 (文字, 字体, 字号) 缓存
+        from reportlab.pdfbase import pdfmetrics
+        return pdfmetrics.stringWidth(text, font, size)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _format_qso_date(date_str):
+        # YYYYMMDD -> D.M.YYYY；批量打印时同一日期反复出现，strptime 结果按日期字符串缓存。无法解析时原样返回
+        try:
+            d_obj = datetime.datetime.strptime(date_str, '%Y%m%d')
+            return f"{d_obj.day}.{d_obj.month}.{d_obj.year}"[-10:] # Short format
+        except Exception:
+            return date_str
 
     @staticmethod
     def _draw_mixed_string(c, x, y, text, fonts, size, align='left'):
-        """支持中文混排的绘制函数"""
+        """支持中文混排的绘制函数，返回绘制文字的总宽度"""
         eng_font, zh_font = fonts
         if not text: text = ""
         text = str(text)
-        
+
+        # 每段只判断一次字体、计算一次宽度，居中与逐段绘制共用
+        # 呼号、日期、频率等纯 ASCII 文本 (绝大多数) 整段使用英文字体，不必走正则切分
+        parts = ((text,) if text else ()) if text.isascii() else CJK_SEGMENT_RE.findall(text)
+        segments = []
+        for segment in parts:
+            font_to_use = zh_font if '\u4e00' <= segment[0] <= '\u9fff' else eng_font
+            segments.append((segment, font_to_use, NewLayoutPrinter._string_width(segment, font_to_use, size)))
         # 计算总宽度用于居中
-        total_width = 0
-        segments = re.findall(r'([\u4e00-\u9fff]+|[^\u4e00-\u9fff]+)', text)
-        if align == 'center':
-            for segment in segments:
-                is_chinese = '\u4e00' <= segment[0] <= '\u9fff'
-                font_to_use = zh_font if is_chinese else eng_font
-                total_width += pdfmetrics.stringWidth(segment, font_to_use, size)
-            cursor_x = x - (total_width / 2)
-        else:
-            cursor_x = x
+        total_width = sum(width for _, _, width in segments)
+        cursor_x = x - total_width / 2 if align == 'center' else x
 
-        for segment in segments:
-            is_chinese = '\u4e00' <= segment[0] <= '\u9fff'
-            font_to_use = zh_font if is_chinese else eng_font
+        for segment, font_to_use, width in segments:
             c.setFont(font_to_use, size)
             c.drawString(cursor_x, y, segment)
-            cursor_x += c.stringWidth(segment, font_to_use, size)
+            cursor_x += width
+        return total_width
     @staticmethod
-    def _get_pixmap_from_pdf(pdf_buffer):
+    def _get_pixmaps_from_pdf(pdf_path, page_indexes):
         """
-        使用 PyMuPDF (fitz) 从 BytesIO 缓冲区中加载 PDF 并渲染为 PIL 图像。
+        使用 PyMuPDF (fitz) 从已写入磁盘的 PDF 文件加载，并把指定的各页依次渲染为 PIL 图像 (生成器)。
+        整批标签只打开、解析一次 PDF，而不是每张卡重新打开一次。
         """
+        import fitz # PyMuPDF
+        from PIL import Image
+        doc = fitz.open(pdf_path)
         try:
-            # 使用 fitz.open 从 BytesIO 打开 PDF
-            pdf_buffer.seek(0)
-            doc = fitz.open("pdf", pdf_buffer.read())
-            if not doc or doc.page_count == 0:
-                print("Error: PDF buffer is empty or invalid.")
-                return None
-            
-            # 渲染第一页
-            page = doc.load_page(0)
-            # 设置分辨率（例如 300 DPI）
-            zoom_x = 300 / 72  # 72 points per inch is standard PDF resolution
-            zoom_y = 300 / 72
-            matrix = fitz.Matrix(zoom_x, zoom_y)
-            
-            # 获取像素图
-            pix = page.get_pixmap(matrix=matrix)
-            doc.close()
-
-            # 将 fitz.Pixmap 转换为 PIL Image
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            return img
-
-        except Exception as e:
-            print(f"Error rendering PDF to image: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
+            if doc.page_count == 0:
+                print("Error: PDF file is empty or invalid.")
+                return
+            # 设置分辨率（例如 300 DPI, 72 points per inch is standard PDF resolution）
+            matrix = fitz.Matrix(300 / 72, 300 / 72)
+            for page_index in page_indexes:
+                # 标签只有黑白灰内容，直接按灰度渲染：像素数据只有 RGB 的 1/3，PNG 编码耗时与文件体积约减半
+                pix = doc.load_page(page_index).get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+                # 将 fitz.Pixmap 转换为 PIL Image
+                yield Image.frombytes("L", [pix.width, pix.height], pix.samples)
+        finally: doc.close()
 
     @staticmethod
-    def _render_and_output_as_png(qsl_id, pdf_buffer, parent_widget):
+    def _render_and_output_as_png(qsl_ids, pdf_path, parent_widget, page_indexes, on_progress=None):
         """
-        将 PDF 渲染成 PNG 图像用于界面预览。
+        将 PDF 渲染成 PNG 图像用于界面预览：qsl_ids 中每张卡保存 page_indexes 中对应的一页。
+        on_progress(已保存张数) 在每张预览保存后调用。
         """
         try:
-            img = NewLayoutPrinter._get_pixmap_from_pdf(pdf_buffer)
-            if img:
+            for done, (qsl_id, img) in enumerate(zip(qsl_ids, NewLayoutPrinter._get_pixmaps_from_pdf(pdf_path, page_indexes)), 1):
                 # 1. 临时保存 PNG (可选，用于调试)
                 png_path = os.path.join(LABELS_DIR, f"{qsl_id}.png")
                 img.save(png_path)
@@ -281,9 +413,67 @@ class NewLayoutPrinter:
                     parent_widget.display_qsl_preview(pixmap)
                 
                 print(f"Preview PNG saved to: {png_path}")
+                if on_progress: on_progress(done)
 
         except Exception as e:
             print(f"Failed to generate PNG preview: {e}")
+            import traceback
+            traceback.print_exc()
+
+    @staticmethod
+    def _build_labels(draw_func, pairs, fonts, pdf_path, on_progress=None):
+        """把 [(qsl_id, log_data_list), ...] 依次画到同一个 PDF 中，返回每张标签起始页的页码 (从 0 开始)。
+        on_progress(已画张数) 在每张标签画完后调用。"""
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.pagesizes import mm
+        c = canvas.Canvas(pdf_path, pagesize=(70 * mm, 50 * mm))
+        first_pages = []
+        for done, (qsl_id, log_data_list) in enumerate(pairs, 1):
+            first_pages.append(c.getPageNumber() - 1)
+            draw_func(c, qsl_id, log_data_list, fonts)
+            if on_progress: on_progress(done)
+        c.save()
+        return first_pages
+
+    @staticmethod
+    def _start_label_job(draw_func, pairs, parent_widget, success_msg, fail_title):
+        """把标签的 PDF/PNG 生成放到后台线程，完成后在界面线程弹出提示并打印。
+        pairs 为 [(qsl_id, log_data_list), ...]；多张标签合并为一个 PDF，只提示并打印一次。"""
+        os.makedirs(LABELS_DIR, exist_ok=True)
+        os.makedirs(PRINTS_DIR, exist_ok=True)
+        pairs = [(qsl_id, list(log_data_list)) for qsl_id, log_data_list in pairs]
+        if not pairs: return
+        if len(pairs) == 1:
+            pdf_path = os.path.join(PRINTS_DIR, f"{pairs[0][0]}.pdf")
+        else:
+            # 批量文件名以首尾 QSL ID 标识
+            pdf_path = os.path.join(PRINTS_DIR, f"{pairs[0][0]}_{pairs[-1][0]}.pdf")
+        fonts = NewLayoutPrinter._setup_fonts() # 字体注册在界面线程完成，工作线程只读
+        job = LabelJob(draw_func, pairs, fonts, pdf_path)
+        # 多张标签时显示进度 (单张很快完成，不弹出进度框)
+        progress_dialog = None
+        if len(pairs) > 1:
+            progress_dialog = QProgressDialog(f"正在生成 {len(pairs)} 张标签...", None, 0, 2 * len(pairs), parent_widget)
+            progress_dialog.setWindowTitle("生成标签"); progress_dialog.setWindowModality(Qt.WindowModal)
+            progress_dialog.setMinimumDuration(0); progress_dialog.setAutoClose(False); progress_dialog.setAutoReset(False)
+            job.signals.progress.connect(progress_dialog.setValue)
+
+        def on_finished(pdf_path):
+            LabelJob.active_jobs.discard(job)
+            if progress_dialog: progress_dialog.close()
+            QMessageBox.information(parent_widget, *success_msg)
+            NewLayoutPrinter._print_file(pdf_path)
+
+        def on_failed(error):
+            LabelJob.active_jobs.discard(job)
+            if progress_dialog: progress_dialog.close()
+            QMessageBox.critical(parent_widget, fail_title, f"生成出错: {error}")
+
+        job.signals.finished.connect(on_finished)
+        job.signals.failed.connect(on_failed)
+        if progress_dialog: progress_dialog.show()
+        LabelJob.active_jobs.add(job) # 保持引用直到回调执行
+        LabelJob.pool().start(job)
 
     @staticmethod
     def generate_layout_1(qsl_id, log_data_list, parent_widget):
@@ -291,22 +481,40 @@ class NewLayoutPrinter:
         生成 70mm x 50mm 标签。
         1-N页：6x6 网格布局的 QSO 数据。
         最后一页：独立的 QSL ID 和 居中二维码（用于贴信封）。
+        PDF/PNG 在后台线程生成，完成后回到界面线程提示并打印。
         """
-        os.makedirs(LABELS_DIR, exist_ok=True)
-        os.makedirs(PRINTS_DIR, exist_ok=True)
-        pdf_buffer = BytesIO()
+        NewLayoutPrinter.generate_layout_1_batch([(qsl_id, log_data_list)], parent_widget)
+
+    @staticmethod
+    def generate_layout_1_batch(pairs, parent_widget):
+        """多卡模式：把 [(qsl_id, log_data_list), ...] 的发卡标签合并到一个 PDF 中，只生成并打印一次。"""
+        ids = [qsl_id for qsl_id, _ in pairs]
+        if not ids: return
+        id_text = ids[0] if len(ids) == 1 else f"{ids[0]} ~ {ids[-1]} (共 {len(ids)} 张)"
+        NewLayoutPrinter._start_label_job(NewLayoutPrinter._draw_layout_1, pairs, parent_widget,
+                                          ("生成成功", f"已生成 QSL ID/二维码标签（收卡）：{id_text}"), "生成失败")
+
+    # 卫星 QSO 的频率栏：(下行频段, 上行频段) -> 显示文字
+    SAT_FREQ_DISPLAY = {(435, 145): "145/435", (145, 435): "435/145", (435, 435): "435/435", (145, 145): "145/145"}
+
+    @staticmethod
+    def _sat_band(freq_mhz):
+        if 400 < freq_mhz < 500: return 435
+        if 140 < freq_mhz < 150: return 145
+        return None
+
+    @staticmethod
+    def _draw_layout_1(c, qsl_id, log_data_list, fonts):
+        """在画布 c 上绘制一张发卡标签 (若干页)。在工作线程中调用，不可操作界面。"""
+        from reportlab.lib.pagesizes import mm
+        from reportlab.pdfbase import pdfmetrics
         
         # -----------------------------------------------------------------
         # 【QR Code 手动调节变量区域】
         # -----------------------------------------------------------------
-        # 1. QR Code 容错率 (L, M, Q, H) - H为最高容错
-        QR_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_H
+        # 1. 容错率 / 框大小 / 边框 见 _qr_image (所有版式共用同一张二维码图)
         # 2. QR Code 尺寸 (ReportLab mm) - 推荐不超过 10mm
         QR_SIZE_MM = 10 * mm
-        # 3. QR Code 框的大小系数 (影响像素密度，不推荐修改)
-        QR_BOX_SIZE = 10 
-        # 4. QR Code 边框大小 (0为无边框，最小化尺寸)
-        QR_BORDER = 0
         # 5. 二维码垂直偏移量 (正值向上移动，负值向下移动)
         QR_Y_OFFSET_MM = 17 * mm # 建议从 1.5mm 开始测试
         # -----------------------------------------------------------------
@@ -323,280 +531,219 @@ class NewLayoutPrinter:
         row_h = L_HEIGHT / ROWS
         half_row_h = row_h / 2
 
-        try:
-            fonts = NewLayoutPrinter._setup_fonts()
-            c = canvas.Canvas(pdf_buffer, pagesize=(L_WIDTH, L_HEIGHT))
+        qr_image_reader = NewLayoutPrinter._qr_image_reader(qsl_id)
+        
+        # --- 第一部分：生成 QSO 数据页 ---
+        logs_per_page = 4
+        log_chunks = [log_data_list[i:i + logs_per_page] for i in range(0, len(log_data_list), logs_per_page)]
+
+        # 辅助函数：获取单元格中心坐标 (Grid: 0,0 is Top-Left)；只依赖版面尺寸，在分页循环外定义一次
+        def get_cell_center(r, c_idx, sub_row=None):
+            """
+            r: 行索引 (0-5)
+            c_idx: 列索引 (0-5)
+            sub_row: 0 for upper half, 1 for lower half (Only for rows 2-5)
+            """
             
-            # --- 第一部分：生成 QSO 数据页 ---
-            logs_per_page = 4
-            log_chunks = [log_data_list[i:i + logs_per_page] for i in range(0, len(log_data_list), logs_per_page)]
-
-            for page_num, chunk in enumerate(log_chunks):
-                # 获取第一条日志用于头部信息
-                first_log = dict(chunk[0]) 
-                to_radio = str(first_log.get('station_callsign') or '')
-
-                # 辅助函数：获取单元格中心坐标 (Grid: 0,0 is Top-Left)
-                def get_cell_center(r, c_idx, sub_row=None):
-                    """
-                    r: 行索引 (0-5)
-                    c_idx: 列索引 (0-5)
-                    sub_row: 0 for upper half, 1 for lower half (Only for rows 2-5)
-                    """
-                    
-                    if sub_row is None or r < 2 or r > 5:
-                        # 正常单元格（行 0, 1）
-                        x = (c_idx * col_w) + (col_w / 2)
-                        y = L_HEIGHT - (r * row_h) - (row_h / 2) - 1*mm 
-                    else:
-                        # 分割单元格（行 2-5）
-                        x = (c_idx * col_w) + (col_w / 2)
-                        
-                        # 计算当前行 (r) 的底部 ReportLab 坐标
-                        y_bottom = L_HEIGHT - ((r + 1) * row_h) 
-                        
-                        if sub_row == 0: # 上半部分 (Upper)
-                            # y 轴中心点: y_bottom + 1.5 * half_row_h
-                            y = y_bottom + 1.5 * half_row_h - 1*mm # Visual adjustment
-                        else: # 下半部分 (Lower)
-                            # y 轴中心点: y_bottom + 0.5 * half_row_h
-                            y = y_bottom + 0.5 * half_row_h - 1*mm # Visual adjustment
-                            
-                    return x, y
-                
-                # --- 第二行左侧对齐点：Col 0 的中心位置 ---
-                QSO_LINE2_ALIGN_X = 0.5 * col_w
-
-                # --- Row 0: Header ---
-                
-                # 绘制 To Radio 固定文本 (放大字体)
-                header_text = "To Radio:"
-                header_font_size = 14 # 固定文字使用 12pt
-                
-                # 绘制对方呼号 <His call> (较小字体)
-                callsign_text = str(to_radio)
-                callsign_font_size = 10 # 呼号使用 10pt
+            if sub_row is None or r < 2 or r > 5:
+                # 正常单元格（行 0, 1）
+                x = (c_idx * col_w) + (col_w / 2)
+                y = L_HEIGHT - (r * row_h) - (row_h / 2) - 1*mm 
+            else:
+                # 分割单元格（行 2-5）
+                x = (c_idx * col_w) + (col_w / 2)
                 
-                # 1. 绘制固定文本 "To Radio : " (左对齐)
-                start_x = 2*mm
-                start_y = L_HEIGHT - row_h + 2.5*mm
+                # 计算当前行 (r) 的底部 ReportLab 坐标
+                y_bottom = L_HEIGHT - ((r + 1) * row_h) 
                 
-                NewLayoutPrinter._draw_mixed_string(c, start_x, start_y, header_text, fonts, header_font_size, align='left')
+                if sub_row == 0: # 上半部分 (Upper)
+                    # y 轴中心点: y_bottom + 1.5 * half_row_h
+                    y = y_bottom + 1.5 * half_row_h - 1*mm # Visual adjustment
+                else: # 下半部分 (Lower)
+                    # y 轴中心点: y_bottom + 0.5 * half_row_h
+                    y = y_bottom + 0.5 * half_row_h - 1*mm # Visual adjustment
+                    
+            return x, y
+
+        for page_num, chunk in enumerate(log_chunks):
+            # 获取第一条日志用于头部信息
+            first_log = chunk[0] # sqlite3.Row / dict 均支持按列名取值，无需复制成 dict
+            to_radio = str(first_log['station_callsign'] or '')
+            
+            # --- 第二行左侧对齐点：Col 0 的中心位置 ---
+            QSO_LINE2_ALIGN_X = 0.5 * col_w
+
+            # --- Row 0: Header ---
+            
+            # 绘制 To Radio 固定文本 (放大字体)
+            header_text = "To Radio:"
+            header_font_size = 14 # 固定文字使用 12pt
+            
+            # 绘制对方呼号 <His call> (较小字体)
+            callsign_text = str(to_radio)
+            callsign_font_size = 10 # 呼号使用 10pt
+            
+            # 1. 绘制固定文本 "To Radio : " (左对齐)
+            start_x = 2*mm
+            start_y = L_HEIGHT - row_h + 2.5*mm
+            
+            # 2. 绘制时即得到固定文本的宽度，以便从其后开始绘制呼号 (无需再单独测量)
+            header_width = NewLayoutPrinter._draw_mixed_string(c, start_x, start_y, header_text, fonts, header_font_size, align='left')
+            callsign_x = start_x + header_width
+            
+            # 3. 绘制呼号
+            NewLayoutPrinter._draw_mixed_string(c, callsign_x, start_y, callsign_text, fonts, callsign_font_size, align='left')
+
+            # 绘制 PSE QSL TNX
+            # Col 4-5
+            cx_pse, cy_pse = get_cell_center(0, 4.5) 
+            NewLayoutPrinter._draw_mixed_string(c, cx_pse, cy_pse, "PSE QSL TNX", fonts, 7, align='center')
+
+            # --- Row 1: Columns Headers ---
+            headers = ["Date", "UTC", "RST", "MHz", "Mode"]
+            header_cols = [0, 1, 2, 3, 4]
+            
+            for col_idx, text in zip(header_cols, headers):
+                cx, cy = get_cell_center(1, col_idx)
+                NewLayoutPrinter._draw_mixed_string(c, cx, cy, text, fonts, 7, align='center')
+            
+            # 画一条横线在表头下方
+            line_y = L_HEIGHT - (2 * row_h)
+            c.setLineWidth(0.5)
+            # 线条只延伸到 Col 5 的左边界，避免穿过 QR Code
+            c.line(1*mm, line_y, 5 * col_w, line_y) 
+
+            # --- Rows 2~5: QSO Data (Split Rows) ---
+            for i, log in enumerate(chunk): # 行对象直接按列名取值，不再逐行复制成 dict
+                current_grid_row = 2 + i # Start from Row 2 (QSO 1)
+                if current_grid_row > 5: break
+
+                # 本行用到的字段只取一次
+                sat_name = log['sat_name']; mode = log['mode']; freq = log['freq']; freq_rx = log['freq_rx']
                 
-                # 2. 计算固定文本的宽度，以便从其后开始绘制呼号
-                header_width = pdfmetrics.stringWidth(header_text, fonts[0], header_font_size) 
-                callsign_x = start_x + header_width
+                # ----------------------------------------------------
+                # A. 上半部分 (sub_row=0): 原始 QSO 信息 + 频率判定
+                # ----------------------------------------------------
                 
-                # 3. 绘制呼号
-                NewLayoutPrinter._draw_mixed_string(c, callsign_x, start_y, callsign_text, fonts, callsign_font_size, align='left')
-
-                # 绘制 PSE QSL TNX
-                # Col 4-5
-                cx_pse, cy_pse = get_cell_center(0, 4.5) 
-                NewLayoutPrinter._draw_mixed_string(c, cx_pse, cy_pse, "PSE QSL TNX", fonts, 7, align='center')
+                # Date Formatting
+                formatted_date = NewLayoutPrinter._format_qso_date(log['qso_date'])
+
+                # 基础数据列 (Date, UTC, RST, Mode)
+                base_row_data = [
+                    formatted_date,
+                    str(log['time_on'] or '')[:4],
+                    str(log['rst_rcvd'] or ''),
+                    str(mode or '')[:7] 
+                ]
+                base_cols = [0, 1, 2, 4] # 跳过 MHz 列 (Col 3)
+
+                for col_idx, text in zip(base_cols, base_row_data):
+                    cx, cy = get_cell_center(current_grid_row, col_idx, sub_row=0)
+                    font_size = 6
+                    if len(text) > 7: font_size = 5 # Auto shrink
+                    NewLayoutPrinter._draw_mixed_string(c, cx, cy, text, fonts, font_size, align='center')
+
+                # 频率 (MHz) 判定逻辑 (Col 3)
+                if sat_name:
+                    # 卫星频率判定逻辑：上下行各归入 145 / 435 频段后查表，不属于这两个频段时原样显示
+                    try: sat_bands = (NewLayoutPrinter._sat_band(float(freq_rx or 0)), NewLayoutPrinter._sat_band(float(freq or 0)))
+                    except (TypeError, ValueError): sat_bands = None
+                    freq_display = NewLayoutPrinter.SAT_FREQ_DISPLAY.get(sat_bands) or f"{str(freq or '')}/{str(freq_rx or '')}"
+                elif mode == 'EYEBALL':
+                    freq_display = "N/A"
+                else:
+                    freq_display = str(freq or '')[:7]
 
-                # --- Row 1: Columns Headers ---
-                headers = ["Date", "UTC", "RST", "MHz", "Mode"]
-                header_cols = [0, 1, 2, 3, 4]
+                cx, cy = get_cell_center(current_grid_row, 3, sub_row=0) # Col 3
+                NewLayoutPrinter._draw_mixed_string(c, cx, cy, freq_display, fonts, 7, align='center')
                 
-                for col_idx, text in zip(header_cols, headers):
-                    cx, cy = get_cell_center(1, col_idx)
-                    NewLayoutPrinter._draw_mixed_string(c, cx, cy, text, fonts, 7, align='center')
+                # ----------------------------------------------------
+                # B. 下半部分 (sub_row=1): 备注及卫星信息
+                # ----------------------------------------------------
+                cy_bottom = get_cell_center(current_grid_row, 0, sub_row=1)[1]
                 
-                # 画一条横线在表头下方
-                line_y = L_HEIGHT - (2 * row_h)
-                c.setLineWidth(0.5)
-                # 线条只延伸到 Col 5 的左边界，避免穿过 QR Code
-                c.line(1*mm, line_y, 5 * col_w, line_y) 
-
-                # --- Rows 2~5: QSO Data (Split Rows) ---
-                for i, log_row in enumerate(chunk):
-                    current_grid_row = 2 + i # Start from Row 2 (QSO 1)
-                    if current_grid_row > 5: break
-
-                    log = dict(log_row)
-                    
-                    # ----------------------------------------------------
-                    # A. 上半部分 (sub_row=0): 原始 QSO 信息 + 频率判定
-                    # ----------------------------------------------------
-                    
-                    # Date Formatting
-                    date_str = log.get('qso_date')
-                    try:
-                        d_obj = datetime.datetime.strptime(date_str, '%Y%m%d')
-                        formatted_date = f"{d_obj.day}.{d_obj.month}.{d_obj.year}"[-10:] # Short format
-                    except: 
-                        formatted_date = date_str
-
-                    # 基础数据列 (Date, UTC, RST, Mode)
-                    base_row_data = [
-                        formatted_date,
-                        str(log.get('time_on') or '')[:4],
-                        str(log.get('rst_rcvd') or ''),
-                        str(log.get('mode') or '')[:7] 
-                    ]
-                    base_cols = [0, 1, 2, 4] # 跳过 MHz 列 (Col 3)
-
-                    for col_idx, text in zip(base_cols, base_row_data):
-                        cx, cy = get_cell_center(current_grid_row, col_idx, sub_row=0)
-                        font_size = 6
-                        if len(text) > 7: font_size = 5 # Auto shrink
-                        NewLayoutPrinter._draw_mixed_string(c, cx, cy, text, fonts, font_size, align='center')
-
-                    # 频率 (MHz) 判定逻辑 (Col 3)
-                    freq_display = ""
-                    if log.get('sat_name'):
-                        try:
-                            # 卫星频率判定逻辑
-                            freq_rx = float(log.get('freq_rx') or 0)
-                            freq_tx = float(log.get('freq') or 0)
-                            
-                            if 400 < freq_rx < 500 and 140 < freq_tx < 150: freq_display = "145/435"
-                            elif 140 < freq_rx < 150 and 400 < freq_tx < 500: freq_display = "435/145"
-                            elif 400 < freq_rx < 500 and 400 < freq_tx < 500: freq_display = "435/435"
-                            elif 140 < freq_rx < 150 and 140 < freq_tx < 150: freq_display = "145/145"
-                            else: freq_display = f"{str(log.get('freq') or '')}/{str(log.get('freq_rx') or '')}"
-                            
-                        except: 
-                            freq_display = f"{str(log.get('freq') or '')}/{str(log.get('freq_rx') or '')}"
-                            
-                    elif log.get('mode') == 'EYEBALL':
-                        freq_display = "N/A"
-                    else:
-                        freq_display = str(log.get('freq') or '')[:7]
-
-                    cx, cy = get_cell_center(current_grid_row, 3, sub_row=0) # Col 3
-                    NewLayoutPrinter._draw_mixed_string(c, cx, cy, freq_display, fonts, 7, align='center')
+                # 1. 备注信息 (左侧)
+                comment = str(log['comment'] or '')
+                comment_text = f"备注: {comment[:25]}" if comment else ""
+                
+                # 2. 卫星/类型信息 (右侧)
+                info_text = ""
+                if sat_name:
+                    info_text = f"Satellite: via {sat_name}"
+                elif mode == 'EYEBALL':
+                    info_text = f"Type: {str(log['submode'] or '')}"
                     
-                    # ----------------------------------------------------
-                    # B. 下半部分 (sub_row=1): 备注及卫星信息
-                    # ----------------------------------------------------
-                    cy_bottom = get_cell_center(current_grid_row, 0, sub_row=1)[1]
+                # 绘制备注 (左侧) - 对齐到 Col 0 中心
+                if comment_text:
+                    NewLayoutPrinter._draw_mixed_string(c, QSO_LINE2_ALIGN_X, cy_bottom, comment_text, fonts, 6, align='left')
                     
-                    # 1. 备注信息 (左侧)
-                    comment = str(log.get('comment') or '')
-                    comment_text = ""
+                    # 卫星信息在备注右侧，留出间距
+                    comment_width = pdfmetrics.stringWidth(comment_text, fonts[1], 6) 
+                    cx_info = QSO_LINE2_ALIGN_X + comment_width + 3*mm # 3mm 间距
+                    NewLayoutPrinter._draw_mixed_string(c, cx_info, cy_bottom, info_text, fonts, 6, align='left')
+                else:
+                     # 如果没有备注，则卫星信息从 Col 0 中心开始
+                    NewLayoutPrinter._draw_mixed_string(c, QSO_LINE2_ALIGN_X, cy_bottom, info_text, fonts, 6, align='left')
                     
-                    if comment:
-                        comment_text = f"备注: {comment[:25]}"
+                # ----------------------------------------------------
+                # C. 绘制水平分隔线 (仅在 Row 2, 3, 4 底部绘制)
+                # ----------------------------------------------------
+                # 确保不绘制最底下一根分割线 (current_grid_row = 5)
+                if current_grid_row < 5: 
+                    line_y_qso = L_HEIGHT - ((current_grid_row + 1) * row_h)
+                    c.setLineWidth(0.2)
                     
-                    # 2. 卫星/类型信息 (右侧)
-                    info_text = ""
-                    if log.get('sat_name'):
-                        info_text = f"Satellite: via {log.get('sat_name')}"
-                    elif log.get('mode') == 'EYEBALL':
-                        info_text = f"Type: {str(log.get('submode') or '')}"
-                        
-                    # 绘制备注 (左侧) - 对齐到 Col 0 中心
-                    if comment_text:
-                        NewLayoutPrinter._draw_mixed_string(c, QSO_LINE2_ALIGN_X, cy_bottom, comment_text, fonts, 6, align='left')
-                        
-                        # 卫星信息在备注右侧，留出间距
-                        comment_width = pdfmetrics.stringWidth(comment_text, fonts[1], 6) 
-                        cx_info = QSO_LINE2_ALIGN_X + comment_width + 3*mm # 3mm 间距
-                        NewLayoutPrinter._draw_mixed_string(c, cx_info, cy_bottom, info_text, fonts, 6, align='left')
-                    else:
-                         # 如果没有备注，则卫星信息从 Col 0 中心开始
-                        NewLayoutPrinter._draw_mixed_string(c, QSO_LINE2_ALIGN_X, cy_bottom, info_text, fonts, 6, align='left')
-                        
-                    # ----------------------------------------------------
-                    # C. 绘制水平分隔线 (仅在 Row 2, 3, 4 底部绘制)
-                    # ----------------------------------------------------
-                    # 确保不绘制最底下一根分割线 (current_grid_row = 5)
-                    if current_grid_row < 5: 
-                        line_y_qso = L_HEIGHT - ((current_grid_row + 1) * row_h)
-                        c.setLineWidth(0.2)
-                        
-                        # 线条只延伸到 Col 5 的左边界 (即 5*col_w)
-                        line_end_x = 5 * col_w
-                        c.line(1*mm, line_y_qso, line_end_x, line_y_qso)
-
-                # --- 移除垂直分割线：二维码现在占据了 Col 5 的大部分，不需要垂直线 ---
-
-                # --- NEW: Col 5, Rows 1-5: QR Code 区域 ---
-                
-                # 1. 定义区域坐标 (Grid: (1,5) to (5,5))
-                qr_area_x_start = 5 * col_w
-                qr_area_y_bottom = L_HEIGHT - (6 * row_h) # Bottom edge of Row 5
-                qr_area_y_top = L_HEIGHT - (1 * row_h)   # Top edge of Row 1
-                
-                qr_area_width = col_w
-                qr_area_height = 5 * row_h
+                    # 线条只延伸到 Col 5 的左边界 (即 5*col_w)
+                    line_end_x = 5 * col_w
+                    c.line(1*mm, line_y_qso, line_end_x, line_y_qso)
 
-                # 2. 计算区域中心点
-                center_x = qr_area_x_start + (qr_area_width / 2)
-                # [修改行] 使用偏移量 QR_Y_OFFSET_MM (正值向上)
-                center_y = qr_area_y_bottom + (qr_area_height / 2) + QR_Y_OFFSET_MM
+            # --- 移除垂直分割线：二维码现在占据了 Col 5 的大部分，不需要垂直线 ---
 
-                # 3. 确定二维码绘制尺寸 (使用定义的变量)
-                qr_size_mm = min(QR_SIZE_MM, qr_area_height - 2*mm, qr_area_width - 2*mm) # 留出 2mm 边距
-                
-                # 4. 生成 QR Code Image (使用定义的变量)
-                qr = qrcode.QRCode(
-                    version=None,
-                    error_correction=QR_ERROR_CORRECTION, 
-                    box_size=QR_BOX_SIZE, 
-                    border=QR_BORDER,
-                )
-                qr.add_data(qsl_id)
-                qr.make(fit=True)
-                
-                img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-
-                # 5. 转换为 ReportLab 可读格式 (BytesIO -> ImageReader)
-                img_buffer = BytesIO()
-                img.save(img_buffer, format='PNG')
-                img_buffer.seek(0)
-                qr_image_reader = ImageReader(img_buffer)
-
-                # 6. 计算绘制起点 (bottom-left corner) 以居中
-                draw_x = center_x - (qr_size_mm / 2)
-                draw_y = center_y - (qr_size_mm / 2)
-
-                # 7. 绘制 QR Code
-                c.drawImage(qr_image_reader, draw_x, draw_y, width=qr_size_mm, height=qr_size_mm)
-
-                c.showPage()
-            # --- 第二部分：生成额外的一页（QSL ID + 二维码） ---
-            # 1. 生成二维码图像
-            qr = qrcode.QRCode(version=None, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=0)
-            qr.add_data(qsl_id)
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-            img_buffer = BytesIO()
-            img.save(img_buffer, format='PNG')
-            img_buffer.seek(0)
-            qr_image_reader = ImageReader(img_buffer)
-
-            # 2. 计算中心位置
-            center_x = L_WIDTH / 2
-            center_y = L_HEIGHT / 2 + QR_PAGE_Y_OFFSET
-            
-            # 3. 绘制二维码
-            draw_x = center_x - (QR_PAGE_SIZE_MM / 2)
-            draw_y = center_y - (QR_PAGE_SIZE_MM / 2)
-            c.drawImage(qr_image_reader, draw_x, draw_y, width=QR_PAGE_SIZE_MM, height=QR_PAGE_SIZE_MM)
+            # --- NEW: Col 5, Rows 1-5: QR Code 区域 ---
             
-            # 4. 绘制 ID 文本 (居中在二维码下方)
-            text_y = draw_y + QR_PAGE_SIZE_MM - 45*mm
-            NewLayoutPrinter._draw_mixed_string(c, center_x, text_y, f"{qsl_id}", fonts, QR_PAGE_FONT_SIZE, align='center')
+            # 1. 定义区域坐标 (Grid: (1,5) to (5,5))
+            qr_area_x_start = 5 * col_w
+            qr_area_y_bottom = L_HEIGHT - (6 * row_h) # Bottom edge of Row 5
+            qr_area_y_top = L_HEIGHT - (1 * row_h)   # Top edge of Row 1
             
-            c.showPage() # 结束二维码页
+            qr_area_width = col_w
+            qr_area_height = 5 * row_h
 
-            # --- 保存与打印 ---
-            c.save()
-            QMessageBox.information(parent_widget, "生成成功", f"已生成 QSL ID/二维码标签（收卡）：{qsl_id}")
+            # 2. 计算区域中心点
+            center_x = qr_area_x_start + (qr_area_width / 2)
+            # [修改行] 使用偏移量 QR_Y_OFFSET_MM (正值向上)
+            center_y = qr_area_y_bottom + (qr_area_height / 2) + QR_Y_OFFSET_MM
+
+            # 3. 确定二维码绘制尺寸 (使用定义的变量)
+            qr_size_mm = min(QR_SIZE_MM, qr_area_height - 2*mm, qr_area_width - 2*mm) # 留出 2mm 边距
             
-            NewLayoutPrinter._render_and_output_as_png(qsl_id, pdf_buffer, parent_widget)
-            temp_pdf_path = os.path.join(PRINTS_DIR, f"{qsl_id}.pdf")
-            with open(temp_pdf_path, "wb") as f:
-                f.write(pdf_buffer.getvalue()) 
-            NewLayoutPrinter._print_file(temp_pdf_path)
+            # 4/5. 二维码已在循环外生成一次 (qr_image_reader)，各页复用
 
-        except Exception as e:
-            QMessageBox.critical(parent_widget, "生成失败", f"生成出错: {e}")
-            import traceback
-            traceback.print_exc()
+            # 6. 计算绘制起点 (bottom-left corner) 以居中
+            draw_x = center_x - (qr_size_mm / 2)
+            draw_y = center_y - (qr_size_mm / 2)
+
+            # 7. 绘制 QR Code
+            c.drawImage(qr_image_reader, draw_x, draw_y, width=qr_size_mm, height=qr_size_mm)
+
+            c.showPage()
+        # --- 第二部分：生成额外的一页（QSL ID + 二维码） ---
+        # 1. 复用同一个二维码图像
+
+        # 2. 计算中心位置
+        center_x = L_WIDTH / 2
+        center_y = L_HEIGHT / 2 + QR_PAGE_Y_OFFSET
+        
+        # 3. 绘制二维码
+        draw_x = center_x - (QR_PAGE_SIZE_MM / 2)
+        draw_y = center_y - (QR_PAGE_SIZE_MM / 2)
+        c.drawImage(qr_image_reader, draw_x, draw_y, width=QR_PAGE_SIZE_MM, height=QR_PAGE_SIZE_MM)
+        
+        # 4. 绘制 ID 文本 (居中在二维码下方)
+        text_y = draw_y + QR_PAGE_SIZE_MM - 45*mm
+        NewLayoutPrinter._draw_mixed_string(c, center_x, text_y, f"{qsl_id}", fonts, QR_PAGE_FONT_SIZE, align='center')
+        
+        c.showPage() # 结束二维码页 (保存、提示与打印由 _start_label_job 完成)
     
     @staticmethod
     def generate_layout_2(qsl_id, log_data_list, parent_widget):
@@ -604,66 +751,49 @@ class NewLayoutPrinter:
         生成 70mm x 50mm 标签（收卡标签）。
         仅生成 QSL ID 二维码页。
         （此方法内容复制自原 generate_layout_1 中的第二页逻辑）
+        PDF/PNG 在后台线程生成，完成后回到界面线程提示并打印。
         """
-        os.makedirs(PRINTS_DIR, exist_ok=True)
-        pdf_buffer = BytesIO()
+        NewLayoutPrinter.generate_layout_2_batch([(qsl_id, log_data_list)], parent_widget)
+
+    @staticmethod
+    def generate_layout_2_batch(pairs, parent_widget):
+        """多卡模式：把多张收卡标签合并到一个 PDF 中，只生成并打印一次。"""
+        ids = [qsl_id for qsl_id, _ in pairs]
+        if not ids: return
+        id_text = ids[0] if len(ids) == 1 else f"{ids[0]} ~ {ids[-1]} (共 {len(ids)} 张)"
+        NewLayoutPrinter._start_label_job(NewLayoutPrinter._draw_layout_2, pairs, parent_widget,
+                                          ("收卡标签生成成功", f"已生成 QSL ID/二维码标签（收卡）：{id_text}"), "收卡标签生成失败")
+
+    @staticmethod
+    def _draw_layout_2(c, qsl_id, log_data_list, fonts):
+        """在画布 c 上绘制一张收卡标签。在工作线程中调用，不可操作界面。"""
+        from reportlab.lib.pagesizes import mm
         
         # 尺寸和常量定义（与 layout_1 的第二页保持一致）
         L_WIDTH, L_HEIGHT = 70 * mm, 50 * mm
         QR_PAGE_SIZE_MM = 35 * mm  # 二维码的尺寸 (较大)
         QR_PAGE_FONT_SIZE = 12     # QSL ID 的字体大小
         QR_PAGE_Y_OFFSET = 5 * mm  # 二维码整体上下偏移（正值向上）
-        
-        try:
-            fonts = NewLayoutPrinter._setup_fonts()
-            c = canvas.Canvas(pdf_buffer, pagesize=(L_WIDTH, L_HEIGHT))
 
-            # --- QSL ID + 二维码 页 (Page 1) ---
-            
-            # 1. 生成二维码图像
-            # 使用高容错率 (H)
-            qr = qrcode.QRCode(version=None, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=0)
-            qr.add_data(qsl_id)
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-            img_buffer = BytesIO()
-            img.save(img_buffer, format='PNG')
-            img_buffer.seek(0)
-            qr_image_reader = ImageReader(img_buffer)
-
-            # 2. 计算中心位置
-            center_x = L_WIDTH / 2
-            center_y = L_HEIGHT / 2 + QR_PAGE_Y_OFFSET
-            
-            # 3. 绘制二维码
-            draw_x = center_x - (QR_PAGE_SIZE_MM / 2)
-            draw_y = center_y - (QR_PAGE_SIZE_MM / 2)
-            c.drawImage(qr_image_reader, draw_x, draw_y, width=QR_PAGE_SIZE_MM, height=QR_PAGE_SIZE_MM)
-            
-            # 4. 绘制 ID 文本 (居中在二维码下方)
-            text_y = center_y + (QR_PAGE_SIZE_MM / 2) - 45*mm
-            NewLayoutPrinter._draw_mixed_string(c, center_x, text_y, f"{qsl_id}", fonts, QR_PAGE_FONT_SIZE, align='center')
-            
-            c.showPage() # 结束二维码页
-
-            # --- 保存与打印 ---
-            c.save()
-            # 更改提示信息和文件名后缀，用于收卡区分
-            QMessageBox.information(parent_widget, "收卡标签生成成功", f"已生成 QSL ID/二维码标签（收卡）：{qsl_id}")
-            
-            # 渲染预览图
-            NewLayoutPrinter._render_and_output_as_png(f"{qsl_id}", pdf_buffer, parent_widget)
-            
-            # 临时保存 PDF 并打印
-            temp_pdf_path = os.path.join(PRINTS_DIR, f"{qsl_id}.pdf")
-            with open(temp_pdf_path, "wb") as f:
-                f.write(pdf_buffer.getvalue()) 
-            NewLayoutPrinter._print_file(temp_pdf_path)
+        # --- QSL ID + 二维码 页 (Page 1) ---
+        
+        # 1. 生成二维码图像 (高容错率 H，按 qsl_id 缓存)
+        qr_image_reader = NewLayoutPrinter._qr_image_reader(qsl_id)
 
-        except Exception as e:
-            QMessageBox.critical(parent_widget, "收卡标签生成失败", f"生成出错: {e}")
-            import traceback
-            traceback.print_exc()
+        # 2. 计算中心位置
+        center_x = L_WIDTH / 2
+        center_y = L_HEIGHT / 2 + QR_PAGE_Y_OFFSET
+        
+        # 3. 绘制二维码
+        draw_x = center_x - (QR_PAGE_SIZE_MM / 2)
+        draw_y = center_y - (QR_PAGE_SIZE_MM / 2)
+        c.drawImage(qr_image_reader, draw_x, draw_y, width=QR_PAGE_SIZE_MM, height=QR_PAGE_SIZE_MM)
+        
+        # 4. 绘制 ID 文本 (居中在二维码下方)
+        text_y = center_y + (QR_PAGE_SIZE_MM / 2) - 45*mm
+        NewLayoutPrinter._draw_mixed_string(c, center_x, text_y, f"{qsl_id}", fonts, QR_PAGE_FONT_SIZE, align='center')
+        
+        c.showPage() # 结束二维码页 (保存、提示与打印由 _start_label_job 完成)
     
     # --- [REPLACE generate_address_label METHOD in NewLayoutPrinter] ---
     @staticmethod
@@ -673,11 +803,13 @@ class NewLayoutPrinter:
         特性：支持管道符(|)强制换行；无管道符时，启用核心行政词 + 16字长度限制自适应换行。
         顶部增加 FROM:/TO: 标题，并增加顶部间距。
         """
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.pagesizes import mm
         ADDRESS_DIR = "address"
         os.makedirs(ADDRESS_DIR, exist_ok=True)
         
         filename_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        pdf_buffer = BytesIO()
+        final_pdf_path = os.path.join(ADDRESS_DIR, f"addr_{filename_id}.pdf")
         
         # 尺寸定义
         L_WIDTH, L_HEIGHT = 70 * mm, 50 * mm
@@ -733,8 +865,7 @@ class NewLayoutPrinter:
 
         try:
             fonts = NewLayoutPrinter._setup_fonts()
-            c = canvas.Canvas(pdf_buffer, pagesize=(L_WIDTH, L_HEIGHT))
-            import re # 确保 re 库被导入
+            c = canvas.Canvas(final_pdf_path, pagesize=(L_WIDTH, L_HEIGHT))
 
             def draw_single_label(info_dict, role_suffix):
                 FONT_SIZE_TITLE = 12 
@@ -799,11 +930,7 @@ class NewLayoutPrinter:
 
             c.save()
 
-            # --- 输出与打印 ---
-            final_pdf_path = os.path.join(ADDRESS_DIR, f"addr_{filename_id}.pdf")
-            with open(final_pdf_path, "wb") as f:
-                f.write(pdf_buffer.getvalue())
-            
+            # --- 打印 (画布已直接写入 final_pdf_path) ---
             NewLayoutPrinter._print_file(final_pdf_path)
             
             return True
@@ -816,24 +943,98 @@ class NewLayoutPrinter:
     
 # --- NFC Writer Class ---
 class NFCWriter:
+    # --- 新增: 串口列表缓存 (Windows 上枚举串口需查询注册表，较慢) ---
+    PORTS_CACHE_SECONDS = 30
+    _ports_cache = None
+    _ports_cache_time = 0
+
     @staticmethod
-    def get_available_ports():
-        """Returns a list of available serial ports."""
+    def get_available_ports(use_cache=True):
+        """Returns a list of available serial ports (cached for PORTS_CACHE_SECONDS unless use_cache is False)."""
+        if use_cache and NFCWriter.cached_ports() is not None: return NFCWriter._ports_cache
+        import serial.tools.list_ports
         ports = serial.tools.list_ports.comports()
-        return [port.device for port in ports]
+        NFCWriter._ports_cache = [port.device for port in ports]; NFCWriter._ports_cache_time = time.monotonic()
+        return NFCWriter._ports_cache
+
+    @staticmethod
+    def cached_ports():
+        """Returns the cached port list if it is still fresh, otherwise None."""
+        if NFCWriter._ports_cache is not None and time.monotonic() - NFCWriter._ports_cache_time < NFCWriter.PORTS_CACHE_SECONDS:
+            return NFCWriter._ports_cache
+        return None
+
+    # --- 新增: 进程内复用同一个串口连接, 避免每次写卡都重新打开 (握手/DTR复位) ---
+    _serial = None
+    _serial_key = None
+    _serial_lock = threading.Lock()
+
+    @staticmethod
+    def _get_serial(port, baudrate):
+        """Returns the shared serial connection, reopening it only when port/baudrate change."""
+        import serial
+        key = (port, baudrate)
+        if NFCWriter._serial is not None and NFCWriter._serial_key == key and NFCWriter._serial.is_open:
+            return NFCWriter._serial
+        NFCWriter.close_port()
+        # write_timeout 让驱动层阻塞等待发送完成, 端口卡死时也不会无限挂起
+        NFCWriter._serial = serial.Serial(port, baudrate, timeout=1, write_timeout=1); NFCWriter._serial_key = key
+        return NFCWriter._serial
+
+    @staticmethod
+    def close_port():
+        """Closes the shared serial connection (called on app exit or port change)."""
+        import serial
+        if NFCWriter._serial is not None:
+            try: NFCWriter._serial.close()
+            except serial.SerialException: pass
+        NFCWriter._serial = None; NFCWriter._serial_key = None
 
     @staticmethod
-    def write_to_port(port, baudrate, data, parent):
-        """Tries to write data to the specified serial port with a newline character."""
+    def write_to_port(port, baudrate, data):
+        """Writes data to the specified serial port with a newline character. Returns None on success, otherwise the error message.
+        May block for up to the 1s timeouts, so it is called from SerialWriteJob rather than the UI thread."""
+        import serial
         try:
-            with serial.Serial(port, baudrate, timeout=1) as ser:
+            with NFCWriter._serial_lock:
+                ser = NFCWriter._get_serial(port, baudrate)
                 # Append a newline character to simulate pressing Enter
-                ser.write((data + '\n').encode('utf-8'))
-                QMessageBox.information(parent, "成功", f"已成功将数据 '{data}' (并附加回车) 发送到端口 {port}。")
-                return True
+                ser.write((data + '\n').encode('utf-8')); ser.flush()
+            return None
         except serial.SerialException as e:
-            QMessageBox.critical(parent, "写入失败", f"无法打开或写入串口 {port}。\n错误: {e}")
-            return False
+            # 连接失效时丢弃, 下次写入重新打开
+            with NFCWriter._serial_lock: NFCWriter.close_port()
+            return str(e)
+
+class PortScanSignals(QObject):
+    ports_ready = pyqtSignal(list)
+
+class PortScanJob(QRunnable):
+    """在线程池中枚举串口，完成后通过 ports_ready 信号回到界面线程。"""
+    def __init__(self):
+        super().__init__()
+        self.setAutoDelete(False) # 由对话框持有引用，保证信号对象在发射时仍然存活
+        self.signals = PortScanSignals()
+
+    def run(self):
+        try: ports = NFCWriter.get_available_ports(use_cache=False)
+        except Exception as e: print(f"Serial port scan failed: {e}"); ports = []
+        self.signals.ports_ready.emit(ports)
+
+class SerialWriteSignals(QObject):
+    finished = pyqtSignal(bool, str) # 是否成功, 错误信息
+
+class SerialWriteJob(QRunnable):
+    """在线程池中写串口 (打开端口与写入最长各等待 1s)，完成后通过 finished 信号回到界面线程。"""
+    def __init__(self, port, baudrate, data):
+        super().__init__()
+        self.setAutoDelete(False) # 由对话框持有引用，保证信号对象在发射时仍然存活
+        self.signals = SerialWriteSignals(); self.port = port; self.baudrate = baudrate; self.data = data
+
+    def run(self):
+        try: error = NFCWriter.write_to_port(self.port, self.baudrate, self.data)
+        except Exception as e: error = str(e)
+        self.signals.finished.emit(error is None, error or "")
 
 # --- Dialogs ---
 class NfcWriteDialog(QDialog):
@@ -855,7 +1056,7 @@ class NfcWriteDialog(QDialog):
         self.baudrate_combo.addItems(['9600', '19200', '38400', '57600', '115200'])
         
         self.refresh_button = QPushButton("刷新端口")
-        self.refresh_button.clicked.connect(self.populate_ports)
+        self.refresh_button.clicked.connect(functools.partial(self.populate_ports, force=True))
         
         port_layout = QHBoxLayout()
         port_layout.addWidget(self.port_combo, 1)
@@ -873,19 +1074,30 @@ class NfcWriteDialog(QDialog):
 
         self.write_button.clicked.connect(self.perform_write)
         self.button_box.rejected.connect(self.reject)
+        self._write_job = None # 正在后台执行的串口写入
         
         self.populate_ports()
-        self.load_saved_settings()
         
-    def populate_ports(self):
+    def populate_ports(self, force=False):
+        """填充串口列表：缓存有效时直接使用，否则在后台线程扫描，避免阻塞界面。"""
+        ports = None if force else NFCWriter.cached_ports()
+        if ports is not None: self._fill_ports(ports); return
+        self.port_combo.clear(); self.port_combo.addItem("正在扫描串口...")
+        self.write_button.setEnabled(False); self.refresh_button.setEnabled(False)
+        self._port_scan_job = PortScanJob()
+        self._port_scan_job.signals.ports_ready.connect(self._fill_ports)
+        QThreadPool.globalInstance().start(self._port_scan_job)
+
+    def _fill_ports(self, ports):
+        self.refresh_button.setEnabled(True)
         self.port_combo.clear()
-        ports = NFCWriter.get_available_ports()
         if not ports:
             self.port_combo.addItem("未找到串口")
             self.write_button.setEnabled(False)
         else:
             self.port_combo.addItems(ports)
             self.write_button.setEnabled(True)
+        self.load_saved_settings()
 
     def load_saved_settings(self):
         saved_port = ConfigManager.get_config("nfc_port")
@@ -901,15 +1113,30 @@ class NfcWriteDialog(QDialog):
         port = self.port_combo.currentText()
         baudrate = int(self.baudrate_combo.currentText())
         
-        if port == "未找到串口":
+        if port in ("未找到串口", "正在扫描串口..."):
             QMessageBox.warning(self, "无端口", "请先连接串口设备并刷新端口列表。")
             return
             
-        ConfigManager.set_config("nfc_port", port)
-        ConfigManager.set_config("nfc_baudrate", baudrate)
-
-        if NFCWriter.write_to_port(port, baudrate, self.qsl_id, self):
+        error = ConfigManager.set_configs({"nfc_port": port, "nfc_baudrate": baudrate})
+        if error: QMessageBox.warning(self, "保存失败", f"串口设置未能保存，本次仍使用所选串口写入。\n错误: {error}")
+
+        # 串口写入在后台线程进行，期间禁用按钮，界面保持响应
+        self.button_box.setEnabled(False); self.refresh_button.setEnabled(False)
+        self._write_job = SerialWriteJob(port, baudrate, self.qsl_id)
+        self._write_job.signals.finished.connect(functools.partial(self._on_write_done, port))
+        QThreadPool.globalInstance().start(self._write_job)
+
+    def _on_write_done(self, port, ok, error):
+        self._write_job = None
+        self.button_box.setEnabled(True); self.refresh_button.setEnabled(True)
+        if ok:
+            QMessageBox.information(self, "成功", f"已成功将数据 '{self.qsl_id}' (并附加回车) 发送到端口 {port}。")
             self.accept()
+        else: QMessageBox.critical(self, "写入失败", f"无法打开或写入串口 {port}。\n错误: {error}")
+
+    def reject(self):
+        # 写入进行中不允许关闭对话框 (Esc / 关闭按钮)，等待结果返回
+        if self._write_job is None: super().reject()
 
 class QSLInventoryUpdateDialog(QDialog):
     """
@@ -974,47 +1201,40 @@ class QSLInventoryUpdateDialog(QDialog):
         # 重新获得焦点，等待下一个 QSL ID
         self.qsl_id_input.setFocus()
 
-class BatchQslModeDialog(QDialog):
-    def __init__(self, log_count, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("选择卡片模式")
-        self.setWindowFlags(self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
-        self.setFixedSize(700, 240)
-        self.mode = None
-        layout = QVBoxLayout(self); layout.addWidget(QLabel(f"您选择了 {log_count} 条日志，请选择处理模式："))
-        self.multi_card_button = QPushButton("多卡模式 (为每条日志生成独立卡号)")
-        self.single_card_button = QPushButton("单卡模式 (为所有日志生成一个卡号)")
-        self.multi_card_button.clicked.connect(self.select_multi_card); self.single_card_button.clicked.connect(self.select_single_card)
-        layout.addWidget(self.multi_card_button); layout.addWidget(self.single_card_button)
-    def select_multi_card(self): self.mode = "multi"; self.accept()
-    def select_single_card(self): self.mode = "single"; self.accept()
-
-class CardActionDialog(QDialog):
-    def __init__(self, title, cards, parent=None):
+class ChoiceDialog(QDialog):
+    """通用的"N 选 1"按钮对话框，exec 后通过 choice 返回所点按钮对应的数据。"""
+    def __init__(self, title, prompt, options, parent=None):
         super().__init__(parent)
         self.setWindowTitle(title)
         self.setWindowFlags(self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
         self.setFixedSize(700, 240)
-        self.selected_card_info = None
-        layout = QVBoxLayout(self)
-        layout.addWidget(QLabel("请选择要操作的卡片："))
+        self.choice = None; self._payloads = []
+        layout = QVBoxLayout(self); self.prompt_label = QLabel(prompt); layout.addWidget(self.prompt_label)
+        # 所有按钮共用一个 QButtonGroup 回调，按钮 id 即 options 下标
+        self.button_group = QButtonGroup(self)
+        for i, (text, payload) in enumerate(options):
+            button = QPushButton(text); button.setEnabled(payload is not None)
+            self.button_group.addButton(button, i); self._payloads.append(payload); layout.addWidget(button)
+        self.button_group.buttonClicked.connect(self._on_button_clicked)
+    def _on_button_clicked(self, button): self.choice = self._payloads[self.button_group.id(button)]; self.accept()
+    def ask(self):
+        """以模态方式显示 (可重复调用同一实例)，返回选中项的数据；取消时返回 None。"""
+        self.choice = None
+        return self.choice if self.exec_() == QDialog.Accepted else None
 
+    @staticmethod
+    def choose(parent, title, prompt, options):
+        """弹出对话框，返回选中项的数据；取消时返回 None。payload 为 None 的选项显示为禁用。"""
+        return ChoiceDialog(title, prompt, options, parent).ask()
+
+    @staticmethod
+    def choose_card(parent, title, cards):
+        """在日志关联的收卡 (RC) / 发卡 (TC) 之间选择，返回所选卡片记录。"""
         rc_card = next((c for c in cards if c['direction'] == 'RC'), None)
         tc_card = next((c for c in cards if c['direction'] == 'TC'), None)
-
-        self.rc_button = QPushButton(f"收卡 (RC): {rc_card['qsl_id'] if rc_card else '无'}")
-        self.rc_button.setEnabled(rc_card is not None)
-        self.rc_button.clicked.connect(lambda: self.select_card(rc_card))
-
-        self.tc_button = QPushButton(f"发卡 (TC): {tc_card['qsl_id'] if tc_card else '无'}")
-        self.tc_button.setEnabled(tc_card is not None)
-        self.tc_button.clicked.connect(lambda: self.select_card(tc_card))
-
-        layout.addWidget(self.rc_button); layout.addWidget(self.tc_button)
-
-    def select_card(self, card_info):
-        self.selected_card_info = card_info
-        self.accept()
+        return ChoiceDialog.choose(parent, title, "请选择要操作的卡片：", [
+            (f"收卡 (RC): {rc_card['qsl_id'] if rc_card else '无'}", rc_card),
+            (f"发卡 (TC): {tc_card['qsl_id'] if tc_card else '无'}", tc_card)])
 
 class SettingsDialog(QDialog):
     data_changed = pyqtSignal()
@@ -1054,14 +1274,11 @@ class SettingsDialog(QDialog):
     def load_settings(self):
         # Load callsign settings
         self.callsign_list.clear(); primary_callsign = ConfigManager.get_config("primary_callsign"); callsigns = self.db_manager.get_all_my_callsigns()
-        for callsign in callsigns:
-            self.callsign_list.addItem(callsign)
-            if callsign == primary_callsign: 
-                try:
-                    item = self.callsign_list.findItems(callsign, Qt.MatchExactly)[0]
-                    item.setFont(QFont("Arial", 12, QFont.Bold)); item.setForeground(Qt.yellow)
-                except IndexError:
-                    pass # Should not happen if callsign exists
+        # 一次性添加全部呼号；主要呼号的行号已知，直接按行号取项，无需 findItems 线性查找
+        self.callsign_list.addItems(callsigns)
+        if primary_callsign in callsigns:
+            item = self.callsign_list.item(callsigns.index(primary_callsign))
+            item.setFont(QFont("Arial", 12, QFont.Bold)); item.setForeground(Qt.yellow)
 
     def handle_reset_data(self):
         reply = QMessageBox.question(self, "危险操作确认", "您确定要重置所有QSL卡片数据吗？\n\n此操作将 **永久删除** 所有已生成的卡号和出入库记录，并将所有日志状态重置为未收/发。\n\n**此操作不可恢复！**", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
@@ -1089,12 +1306,15 @@ class SettingsDialog(QDialog):
         callsign = current_item.text()
         reply = QMessageBox.question(self, "确认删除", f"您确定要删除呼号 '{callsign}' 吗？", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes and self.db_manager.delete_callsign(callsign):
-            if callsign == ConfigManager.get_config("primary_callsign"): ConfigManager.set_config("primary_callsign", "")
+            error = ConfigManager.set_config("primary_callsign", "") if callsign == ConfigManager.get_config("primary_callsign") else None
             self.load_settings()
+            if error: QMessageBox.critical(self, "保存失败", f"无法清除主要呼号设置。\n错误: {error}")
     def set_primary(self):
         current_item = self.callsign_list.currentItem()
         if not current_item: QMessageBox.warning(self, "操作提示", "请先选择一个要设为主用的呼号。"); return
-        callsign = current_item.text(); ConfigManager.set_config("primary_callsign", callsign); self.load_settings(); QMessageBox.information(self, "成功", f"'{callsign}' 已被设为您的主要呼号。")
+        callsign = current_item.text(); error = ConfigManager.set_config("primary_callsign", callsign); self.load_settings()
+        if error: QMessageBox.critical(self, "保存失败", f"无法保存主要呼号设置。\n错误: {error}"); return
+        QMessageBox.information(self, "成功", f"'{callsign}' 已被设为您的主要呼号。")
 
 # --- [REPLACE AddressLabelDialog CLASS] ---
 class AddressLabelDialog(QDialog):
@@ -1182,11 +1402,14 @@ class AddressLabelDialog(QDialog):
         self.s_addr.setPlainText(ConfigManager.get_config("addr_s_addr", ""))
 
     def save_sender_config(self):
-        ConfigManager.set_config("addr_s_name", self.s_name.text())
-        ConfigManager.set_config("addr_s_phone", self.s_phone.text())
-        ConfigManager.set_config("addr_s_zip", self.s_zip.text())
-        ConfigManager.set_config("addr_s_country", self.s_country.text()) # 保存国家
-        ConfigManager.set_config("addr_s_addr", self.s_addr.toPlainText())
+        error = ConfigManager.set_configs({
+            "addr_s_name": self.s_name.text(),
+            "addr_s_phone": self.s_phone.text(),
+            "addr_s_zip": self.s_zip.text(),
+            "addr_s_country": self.s_country.text(), # 保存国家
+            "addr_s_addr": self.s_addr.toPlainText(),
+        })
+        if error: QMessageBox.warning(self, "保存失败", f"寄件人信息未能保存，本次打印不受影响。\n错误: {error}")
 
     def clear_receiver(self):
         self.r_name.clear()
@@ -1236,6 +1459,10 @@ class AddressLabelDialog(QDialog):
             QMessageBox.information(self, "成功", "地址标签已生成并发送至打印队列。")
 
 # --- Log Detail/Edit Dialog ---
+class UpperCaseValidator(QValidator):
+    """输入时直接转为大写 (呼号、卡号输入框)，不必在 textChanged 中再 setText 触发第二次信号。"""
+    def validate(self, text, pos): return QValidator.Acceptable, text.upper(), pos
+
 class LogDetailDialog(QDialog):
     def __init__(self, db_manager, my_callsign, log_id=None, parent=None):
         super().__init__(parent)
@@ -1250,17 +1477,17 @@ class LogDetailDialog(QDialog):
         self.qso_type_combo.currentIndexChanged.connect(self.update_form_layout)
         type_layout = QFormLayout(); type_layout.addRow("通联类型:", self.qso_type_combo); layout.addLayout(type_layout)
         self.form_layout = QFormLayout()
-        self.callsign_input = QLineEdit(); self.callsign_input.textChanged.connect(self.force_uppercase_callsign)
+        self.callsign_input = QLineEdit(); self.callsign_input.setValidator(UpperCaseValidator(self.callsign_input))
         self.qso_date_input = QDateEdit(); self.qso_date_input.setDisplayFormat("yyyy-MM-dd")
         self.time_on_input = QLineEdit()
         
-        band_list = ["", "160m", "80m", "60m", "40m", "30m", "20m", "17m", "15m", "12m", "10m", "6m", "2m", "1.25m", "70cm", "33cm", "23cm", "13cm", "9cm", "5cm", "3cm", "1.2cm", "6mm", "4mm", "2.5mm", "2mm", "1mm", "N/A"]
-        self.band_input = QComboBox(); self.band_input.addItems(band_list)
-        self.band_rx_input = QComboBox(); self.band_rx_input.addItems(band_list)
+        # 波段 / 模式下拉框共用同一个只读列表模型，每次打开对话框不再逐项创建条目
+        self.band_input = QComboBox(); self.band_input.setModel(self.shared_list_model(BANDS_LIST))
+        self.band_rx_input = QComboBox(); self.band_rx_input.setModel(self.shared_list_model(BANDS_LIST))
         
         self.freq_input = QLineEdit(); self.freq_input.editingFinished.connect(self.update_band_from_freq)
         self.freq_rx_input = QLineEdit();
-        self.mode_input = QComboBox(); self.mode_input.addItems(MODES_LIST)
+        self.mode_input = QComboBox(); self.mode_input.setModel(self.shared_list_model(MODES_LIST))
         self.rst_sent_input = QLineEdit(); self.rst_rcvd_input = QLineEdit(); self.comment_input = QTextEdit()
         self.form_layout.addRow("对方呼号:", self.callsign_input); self.form_layout.addRow("日期 (UTC):", self.qso_date_input)
         self.form_layout.addRow("时间 (UTC):", self.time_on_input); self.form_layout.addRow("发射波段:", self.band_input)
@@ -1268,6 +1495,7 @@ class LogDetailDialog(QDialog):
         self.form_layout.addRow("接收频率 (MHz):", self.freq_rx_input); self.form_layout.addRow("模式:", self.mode_input)
         self.form_layout.addRow("发送信号报告:", self.rst_sent_input); self.form_layout.addRow("接收信号报告:", self.rst_rcvd_input)
         self.satellite_frame = QFrame(); self.repeater_frame = QFrame(); self.eyeball_frame = QFrame()
+        self._visible_sections = None # 当前显示的 (卫星, 中继, Eyeball) 区域，未变化时不再切换显隐
         self.setup_dynamic_sections()
         self.form_layout.addRow(self.satellite_frame); self.form_layout.addRow(self.repeater_frame); self.form_layout.addRow(self.eyeball_frame)
         self.form_layout.addRow("备注:", self.comment_input); layout.addLayout(self.form_layout)
@@ -1291,8 +1519,12 @@ class LogDetailDialog(QDialog):
         self.buttons = QDialogButtonBox(QDialogButtonBox.Save | QDialogButtonBox.Cancel)
         self.buttons.accepted.connect(self.accept); self.buttons.rejected.connect(self.reject); layout.addWidget(self.buttons); self.populate_data()
 
-    def force_uppercase_callsign(self, text):
-        self.callsign_input.setText(text.upper())
+    def set_context(self, my_callsign, log_id):
+        """复用编辑对话框：切换到另一条日志，清空不会被 populate_data 覆盖的字段后重新填充。"""
+        self.my_callsign = my_callsign; self.log_id = log_id
+        self.repeater_call_input.clear(); self.eyeball_type_input.setCurrentIndex(0)
+        if self.is_edit_mode: self.rc_card_label.setText("N/A"); self.tc_card_label.setText("N/A")
+        self.populate_data()
 
     def update_band_from_freq(self):
         try:
@@ -1303,13 +1535,25 @@ class LogDetailDialog(QDialog):
             else:
                 freq_mhz = float(freq_text)
 
-            for (lower, upper), band in FREQ_BAND_MAP.items():
-                if lower <= freq_mhz <= upper:
-                    self.band_input.setCurrentText(band)
-                    return
+            band = self.band_for_freq(freq_mhz)
+            if band: self.band_input.setCurrentText(band)
         except ValueError:
             pass # Ignore if input is not a valid float
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def shared_list_model(items):
+        """按条目元组缓存的 QStringListModel，首次使用时创建 (此时 QApplication 已存在)，之后所有下拉框共用。"""
+        return QStringListModel(list(items))
+    @staticmethod
+    def band_for_freq(freq_mhz):
+        """返回频率 (MHz) 所在的业余频段名；不在任何频段内时返回 None。"""
+        # 找到下限 <= freq 的最后一个频段，再检查上限
+        index = bisect.bisect_right(FREQ_BAND_STARTS, freq_mhz) - 1
+        if index < 0: return None
+        upper, band = FREQ_BAND_ENDS[index]
+        return band if freq_mhz <= upper else None
+
     def setup_dynamic_sections(self):
         sat_layout = QFormLayout(self.satellite_frame); self.sat_name_input = QLineEdit(); self.prop_mode_input = QLineEdit()
         sat_layout.addRow("卫星名称:", self.sat_name_input); sat_layout.addRow("传播模式:", self.prop_mode_input)
@@ -1324,7 +1568,14 @@ class LogDetailDialog(QDialog):
         is_sat = "Satellite" in qso_type
         is_rep = "Repeater" in qso_type
         is_eye = "Eyeball" in qso_type
-        self.satellite_frame.setVisible(is_sat); self.repeater_frame.setVisible(is_rep); self.eyeball_frame.setVisible(is_eye)
+        # 区域组合与当前一致时 (如再次打开同类型日志) 跳过显隐切换；否则切换期间暂停重绘，结束后只重新布局、绘制一次
+        sections = (is_sat, is_rep, is_eye)
+        if sections != self._visible_sections:
+            self.setUpdatesEnabled(False)
+            try: self.satellite_frame.setVisible(is_sat); self.repeater_frame.setVisible(is_rep); self.eyeball_frame.setVisible(is_eye)
+            finally: self.setUpdatesEnabled(True)
+            self._visible_sections = sections
+        # 字段默认值每次都要应用 (对话框复用时字段已被重新填充)
         if is_eye:
             self.mode_input.setCurrentText("EYEBALL"); self.band_input.setCurrentText("N/A"); self.band_rx_input.setCurrentText("N/A")
             self.rst_sent_input.setText("59+"); self.rst_rcvd_input.setText("59+")
@@ -1341,18 +1592,11 @@ class LogDetailDialog(QDialog):
         log_data = self.db_manager.get_log_details(self.log_id)
         if not log_data: QMessageBox.critical(self, "错误", "无法加载日志详情。"); self.reject(); return
         
-        # ... 中间代码保持不变 ...
-        
-        self.rst_sent_input.setText(log_data['rst_sent'] or ''); self.rst_rcvd_input.setText(log_data['rst_rcvd'] or '')
-        self.comment_input.setPlainText(log_data['comment'] or ''); self.sat_name_input.setText(log_data['sat_name'] or ''); self.prop_mode_input.setText(log_data['prop_mode'] or '')
-        
         # --- 新增: 加载 QSL 时间 ---
         self.qsl_sent_date_input.setText(log_data['qsl_sent_date'] or '')
         self.qsl_rcvd_date_input.setText(log_data['qsl_rcvd_date'] or '')
         # -------------------------
 
-        if log_data['submode']: self.eyeball_type_input.setCurrentText(log_data['submode'])
-        
         qso_type_to_set = "Basic (HF/VHF/UHF)"
         if log_data['sat_name']:
             qso_type_to_set = "Satellite"
@@ -1362,10 +1606,11 @@ class LogDetailDialog(QDialog):
             qso_type_to_set = "Repeater"
             
         self.qso_type_combo.blockSignals(True); self.qso_type_combo.setCurrentText(qso_type_to_set); self.qso_type_combo.blockSignals(False)
-        self.callsign_input.setText(log_data['station_callsign'] or '')
+        self.callsign_input.setText((log_data['station_callsign'] or '').upper())
         try:
             qso_date_str = log_data['qso_date']
-            if qso_date_str: self.qso_date_input.setDate(QDate.fromString(qso_date_str, "yyyyMMdd"))
+            # 直接按 YYYYMMDD 切片构造日期，无需 Qt 解析格式串
+            if qso_date_str: self.qso_date_input.setDate(QDate(int(qso_date_str[:4]), int(qso_date_str[4:6]), int(qso_date_str[6:8])))
             else: self.qso_date_input.setDate(QDate.currentDate())
         except Exception: self.qso_date_input.setDate(QDate.currentDate())
         self.time_on_input.setText(log_data['time_on'] or ''); self.band_input.setCurrentText((log_data['band'] or '').lower())
@@ -1383,7 +1628,7 @@ class LogDetailDialog(QDialog):
     def get_data(self) -> dict:
         data = { 
             "station_callsign": self.callsign_input.text().upper(), 
-            "qso_date": self.qso_date_input.date().toString("yyyyMMdd"), 
+            "qso_date": "{:04d}{:02d}{:02d}".format(*self.qso_date_input.date().getDate()), 
             "time_on": self.time_on_input.text(), 
             "band": self.band_input.currentText(), 
             "band_rx": self.band_rx_input.currentText(), 
@@ -1411,53 +1656,86 @@ class LogDetailDialog(QDialog):
         return data
 
 # --- Log Table Model ---
+# 日志表格各列的默认宽度 (第 0 列为勾选框，其后依次对应 LogManagementWidget.headers)
+LOG_TABLE_COLUMN_WIDTHS = (40, 60, 140, 140, 130, 90, 110, 110, 130, 130, 110, 90, 90, 300)
+
 class LogTableModel(QAbstractTableModel):
+    # data() 只处理这些角色，其余 (Decoration/Font/SizeHint 等) 直接返回
+    _HANDLED_ROLES = frozenset((Qt.DisplayRole, Qt.CheckStateRole, Qt.ForegroundRole, Qt.TextAlignmentRole))
+    # 视图每次只接入这么多行，滚动到底部时再通过 fetchMore 追加，大结果集不必一次性建立全部行
+    FETCH_BATCH = 500
+    # 颜色对象在类上只构造一次, 所有模型实例与每次重绘共用
+    _GREEN = QColor("green"); _RED = QColor("red")
     def __init__(self, data, headers):
         super().__init__()
-        self._data = data
+        self._data = data; self._loaded = min(len(data), self.FETCH_BATCH)
         self._headers = headers
-        self._checked_states = [Qt.Unchecked] * len(self._data)
+        # 勾选状态: 每行 1 字节, 另以集合记录已勾选行, 取勾选项时只遍历被选中的行
+        self._checked_states = bytearray(len(self._data)); self._checked_indices = set()
         self._qsl_sent_col_idx = headers.index("已发?") + 1
         self._qsl_rcvd_col_idx = headers.index("已收?") + 1
-        self._special_cols = [self._qsl_sent_col_idx, self._qsl_rcvd_col_idx]
+        self._special_cols = frozenset((self._qsl_sent_col_idx, self._qsl_rcvd_col_idx))
+        self._display = [None] * len(self._data)
+
+    def _display_row(self, row):
+        """按需把一行数据转换为显示字符串并缓存，重绘时直接取用。"""
+        disp = self._display[row]
+        if disp is None:
+            special = self._special_cols
+            disp = self._display[row] = tuple(
+                ('✔' if value == 'Y' else '✖') if column in special else str(value or "")
+                for column, value in enumerate(self._data[row], 1)
+            )
+        return disp
 
     def data(self, index, role):
-        if not index.isValid():
+        if role not in self._HANDLED_ROLES or not index.isValid():
             return None
 
         column = index.column()
         row = index.row()
 
         if role == Qt.CheckStateRole and column == 0:
-            return self._checked_states[row]
-
-        value = self._data[row][column - 1] if column > 0 else None
+            return Qt.Checked if self._checked_states[row] else Qt.Unchecked
 
         if role == Qt.DisplayRole:
-            if column in self._special_cols:
-                return '✔' if value == 'Y' else '✖'
             if column > 0:
-                return str(value or "")
+                return self._display_row(row)[column - 1]
+            return None
+
+        # 前景色与对齐只作用于 "已发?/已收?" 两列，其余单元格不必再取值
+        if column not in self._special_cols:
+            return None
 
         if role == Qt.ForegroundRole:
-            if column in self._special_cols:
-                return QColor("green") if value == 'Y' else QColor("red")
+            return self._GREEN if self._data[row][column - 1] == 'Y' else self._RED
 
         if role == Qt.TextAlignmentRole:
-            if column in self._special_cols:
-                return Qt.AlignCenter
+            return Qt.AlignCenter
 
         return None
 
     def setData(self, index, value, role):
         if role == Qt.CheckStateRole and index.column() == 0:
-            self._checked_states[index.row()] = value; self.dataChanged.emit(index, index); return True
+            row = index.row(); checked = value == Qt.Checked; self._checked_states[row] = checked
+            if checked: self._checked_indices.add(row)
+            else: self._checked_indices.discard(row)
+            self.dataChanged.emit(index, index); return True
         return super().setData(index, value, role)
     def flags(self, index):
         flags = super().flags(index)
         if index.column() == 0: flags |= Qt.ItemIsUserCheckable
         return flags
-    def rowCount(self, p): return len(self._data)
+    def rowCount(self, p): return self._loaded
+    def canFetchMore(self, parent): return not parent.isValid() and self._loaded < len(self._data)
+    def fetchMore(self, parent):
+        if parent.isValid(): return
+        self.fetch_to(self._loaded + self.FETCH_BATCH - 1)
+    def fetch_to(self, row):
+        """确保视图已接入第 row 行 (含) 之前的所有行。"""
+        end = min(row + 1, len(self._data))
+        if end <= self._loaded: return
+        self.beginInsertRows(QModelIndex(), self._loaded, end - 1); self._loaded = end; self.endInsertRows()
     def columnCount(self, p): return len(self._headers) + 1
     def headerData(self, section, orientation, role):
         if role == Qt.DisplayRole and orientation == Qt.Horizontal:
@@ -1465,20 +1743,172 @@ class LogTableModel(QAbstractTableModel):
             else: return self._headers[section - 1]
         return None
     def update_data(self, new_data):
-        self.beginResetModel(); self._data = new_data; self._checked_states = [Qt.Unchecked] * len(self._data); self.endResetModel()
-    def get_checked_log_ids(self): return [str(self._data[i][0]) for i, state in enumerate(self._checked_states) if state == Qt.Checked]
+        # 行 (ID 及顺序) 不变时只刷新单元格内容，视图无需整表重置与重新布局
+        if len(new_data) == len(self._data) and all(new_row[0] == old_row[0] for new_row, old_row in zip(new_data, self._data)):
+            self._data = new_data; self._checked_states = bytearray(len(self._data)); self._checked_indices = set(); self._display = [None] * len(self._data)
+            if self._loaded: self.dataChanged.emit(self.index(0, 0), self.index(self._loaded - 1, len(self._headers)))
+            return
+        # 重置后保留之前已接入的行数，刷新后仍可恢复原来的滚动位置
+        self.beginResetModel(); self._data = new_data; self._checked_states = bytearray(len(self._data)); self._checked_indices = set(); self._display = [None] * len(self._data)
+        self._loaded = min(len(self._data), max(self.FETCH_BATCH, self._loaded)); self.endResetModel()
+    def get_checked_log_ids(self): return [str(self._data[i][0]) for i in sorted(self._checked_indices)]
+    def log_ids_at_rows(self, rows): return {self._data[row][0] for row in rows if 0 <= row < self._loaded}
+    def rows_of_log_ids(self, log_ids): return [row for row, log in enumerate(self._data) if log[0] in log_ids] if log_ids else []
+
+class DuplicateMergeSignals(QObject):
+    progress = pyqtSignal(int, int) # 已处理组数, 总组数
+    finished = pyqtSignal(int)      # 合并的组数
+    failed = pyqtSignal(str)        # 错误信息
+
+class DuplicateMergeJob(QRunnable):
+    """在线程池中扫描并合并整个数据库的重复日志。sqlite 连接不能跨线程共用，任务内单独打开连接。"""
+    def __init__(self, db_file):
+        super().__init__()
+        self.setAutoDelete(False) # 由界面持有引用，保证信号对象在发射时仍然存活
+        self.signals = DuplicateMergeSignals(); self.db_file = db_file
+
+    def run(self):
+        db_manager = None
+        try:
+            db_manager = DatabaseManager(self.db_file)
+            self.signals.finished.emit(self.merge_all(db_manager))
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.signals.failed.emit(str(e))
+        finally:
+            if db_manager: db_manager.close()
+
+    def merge_all(self, db_manager):
+        duplicate_sets = db_manager.find_all_duplicates(); total = len(duplicate_sets)
+        self.signals.progress.emit(0, total)
+        if not duplicate_sets: return 0
+
+        merged_count = 0
+        # 各重复组互不相交，一次性取出所有涉及的日志；合并在内存中完成，最后一次批量写回
+        logs_by_id = db_manager.get_logs_by_ids({log_id for duplicate_set in duplicate_sets for log_id in duplicate_set})
+        updated_logs = {}; logs_to_delete = []
+        for duplicate_set in duplicate_sets:
+            log_ids = sorted(list(duplicate_set))
+            master_log_id = log_ids[0]
+            master_log_data = dict(logs_by_id[master_log_id])
+
+            # 任一重复项带来了新信息都需要回写主日志 (标志放在循环外，不被后面的重复项覆盖)
+            needs_update = False
+
+            for duplicate_log_id in log_ids[1:]:
+                duplicate_log_data = logs_by_id.get(duplicate_log_id)
+                if not duplicate_log_data: continue
+
+                for key in MERGEABLE_LOG_FIELDS:
+                    new_value = duplicate_log_data[key]
+                    if new_value and not master_log_data.get(key):
+                        master_log_data[key] = new_value
+                        needs_update = True
+
+                new_comment = duplicate_log_data['comment']; old_comment = master_log_data.get('comment', '')
+                if new_comment and new_comment not in (old_comment or ""):
+                    master_log_data['comment'] = f"{old_comment or ''} | MERGED: {new_comment}".strip(" | "); needs_update = True
+
+                logs_to_delete.append(duplicate_log_id)
+
+            if needs_update: updated_logs[master_log_id] = master_log_data
+
+            merged_count += 1
+            self.signals.progress.emit(merged_count, total)
+
+        if not db_manager.merge_log_entries(updated_logs, logs_to_delete):
+            raise RuntimeError("写入数据库时出错，本次合并已全部回滚。")
+        return merged_count
+
+class AdifImportSignals(QObject):
+    progress = pyqtSignal(int, int)     # 已处理记录数, 总记录数 (0, 0 表示正在写入数据库)
+    finished = pyqtSignal(int, int, int) # 新增, 合并更新, 跳过的重复数
+    failed = pyqtSignal(str)            # 错误信息
+
+class AdifImportJob(QRunnable):
+    """在线程池中解析 ADIF 文件、查重合并并写入数据库，界面线程只显示进度。任务内单独打开 sqlite 连接。"""
+    def __init__(self, db_file, file_path, primary_callsign):
+        super().__init__()
+        self.setAutoDelete(False) # 由界面持有引用，保证信号对象在发射时仍然存活
+        self.signals = AdifImportSignals(); self.db_file = db_file; self.file_path = file_path; self.primary_callsign = primary_callsign
+
+    def run(self):
+        db_manager = None
+        try:
+            db_manager = DatabaseManager(self.db_file)
+            counts = self.import_file(db_manager)
+            if counts is None: self.signals.failed.emit("写入数据库时出错，本次导入已全部回滚。")
+            else: self.signals.finished.emit(*counts)
+        except Exception as e: self.signals.failed.emit(f"无法解析或处理ADIF文件。\n错误: {e}")
+        finally:
+            if db_manager: db_manager.close()
+
+    def import_file(self, db_manager):
+        """返回 (新增, 合并更新, 重复) 计数；写库失败 (已整体回滚) 时返回 None。"""
+        qsos = ADIF_Handler.read_adif_file(self.file_path); imported_count, updated_count, duplicate_count = 0, 0, 0
+        # 一次性转为大写 frozenset，循环内的 OPERATOR 判断为 O(1) 哈希查找
+        my_configured_callsigns = frozenset(c.upper() for c in db_manager.get_all_my_callsigns()); primary_callsign = self.primary_callsign
+        # 先在内存中完成查重与合并，最后一次性写入数据库 (单个事务)
+        qsos = [qso for qso in qsos if all(k in qso for k in ['CALL', 'QSO_DATE', 'TIME_ON', 'BAND'])]
+        # 每条记录的查重键只计算一次，批量查询与逐条比对共用
+        dup_keys = [(qso['CALL'].upper(), qso['QSO_DATE'], qso['BAND'].upper(), (qso.get('MODE') or "").upper()) for qso in qsos]
+        # 一次批量查询取出所有可能重复的已有日志，代替逐条 log_exists / get_log_details
+        existing_by_key = db_manager.find_logs_by_dup_keys(dup_keys)
+        existing_rows = {row['id']: row for rows in existing_by_key.values() for row in rows}
+        new_logs = []; pending_keys = {}; updated_logs = {}
+        for done, (qso, dup_key) in enumerate(zip(qsos, dup_keys)):
+            if done % 500 == 0: self.signals.progress.emit(done, len(qsos))
+            qso_log_data = {key: qso.get(adif_tag) for key, adif_tag in ADIF_IMPORT_FIELDS}; qso_log_data['comment'] = qso.get('COMMENT', '')
+
+            existing_log_id = DatabaseManager.match_time_window(existing_by_key.get(dup_key), qso['TIME_ON'])
+            # 同一文件内的重复记录与本次待插入的新日志比对
+            pending_idx = None if existing_log_id else DatabaseManager.match_time_window(pending_keys.get(dup_key), qso['TIME_ON'])
+            if existing_log_id or pending_idx is not None:
+                if existing_log_id: merged_data = updated_logs.get(existing_log_id) or dict(existing_rows[existing_log_id])
+                else: merged_data = new_logs[pending_idx]
+                needs_update = False
+
+                new_log_data = qso_log_data; new_log_data['my_callsign'] = qso.get('OPERATOR', primary_callsign)
+
+                for key, new_value in new_log_data.items():
+                    if new_value and not merged_data.get(key):
+                        merged_data[key] = new_value; needs_update = True
+
+                new_comment = new_log_data.get('comment', ''); old_comment = merged_data.get('comment', '')
+                if new_comment and new_comment not in (old_comment or ""):
+                    merged_data['comment'] = f"{old_comment or ''} | IMPORTED: {new_comment}".strip(" | "); needs_update = True
+
+                if needs_update:
+                    if existing_log_id: updated_logs[existing_log_id] = merged_data
+                    updated_count += 1
+                else: duplicate_count += 1
+            else:
+                operator = qso.get('OPERATOR', '').upper(); my_call = operator if operator in my_configured_callsigns else primary_callsign
+                log_data = qso_log_data; log_data['my_callsign'] = my_call
+                pending_keys.setdefault(dup_key, []).append({'id': len(new_logs), 'time_on': qso['TIME_ON']}); new_logs.append(log_data); imported_count += 1
+        self.signals.progress.emit(0, 0)
+        if not db_manager.import_log_entries(new_logs, updated_logs): return None
+        return imported_count, updated_count, duplicate_count
 
 # --- Log Management Widget ---
 class LogManagementWidget(QWidget):
     back_to_dashboard_signal = pyqtSignal(); data_changed_signal = pyqtSignal()
-    def __init__(self, db_manager): super().__init__(); self.db_manager = db_manager; self.init_ui(); self.load_initial_data()
+    def __init__(self, db_manager):
+        super().__init__(); self.db_manager = db_manager
+        # 按过滤条件缓存查询结果；数据库有任何写入 (data_version 变化) 时整体失效
+        self._cached_search = functools.lru_cache(maxsize=64)(self._search); self._cache_version = None
+        self._batch_mode_dialog = None # 批量模式选择对话框，首次使用时创建并复用
+        self._merge_job = None # 正在后台运行的查重任务
+        self._edit_dialog = None # 日志编辑对话框，首次使用时创建并复用
+        self.init_ui(); self.load_initial_data()
     def init_ui(self):
         main_layout = QVBoxLayout(self); filter_box = QFrame(); filter_box.setObjectName("filterBox")
         filter_layout = QFormLayout(filter_box)
         self.my_callsign_filter = QLineEdit(); self.my_callsign_filter.setPlaceholderText("实时过滤我方呼号...")
         self.callsign_filter = QLineEdit(); self.callsign_filter.setPlaceholderText("实时过滤对方呼号...")
         self.qsl_id_filter = QLineEdit(); self.qsl_id_filter.setPlaceholderText("通过QSL卡号精确查找...")
-        self.mode_filter = QComboBox(); self.mode_filter.addItems(["全部模式"] + [m for m in MODES_LIST if m])
+        self.mode_filter = QComboBox(); self.mode_filter.addItems(MODE_FILTER_ITEMS)
         filter_layout.addRow("我方呼号:", self.my_callsign_filter); filter_layout.addRow("对方呼号:", self.callsign_filter)
         filter_layout.addRow("QSL卡号:", self.qsl_id_filter); filter_layout.addRow("通联模式:", self.mode_filter)
         button_layout = QHBoxLayout(); self.reset_button = QPushButton("重置所有条件"); self.reorder_button = QPushButton("按时间重排")
@@ -1498,15 +1928,17 @@ class LogManagementWidget(QWidget):
         bottom_button_layout.addWidget(self.check_duplicates_button); bottom_button_layout.addWidget(self.recycle_card_button); bottom_button_layout.addWidget(self.delete_log_button)
         bottom_button_layout.addStretch(); self.back_button = QPushButton("返回主菜单"); bottom_button_layout.addWidget(self.back_button)
         main_layout.addLayout(bottom_button_layout)
-        self.my_callsign_filter.textChanged.connect(lambda text: self.my_callsign_filter.setText(text.upper()))
-        self.my_callsign_filter.textChanged.connect(self.apply_filters)
-        self.callsign_filter.textChanged.connect(lambda text: self.callsign_filter.setText(text.upper()))
-        self.callsign_filter.textChanged.connect(self.apply_filters)
-        self.qsl_id_filter.textChanged.connect(lambda text: self.qsl_id_filter.setText(text.upper()))
+        # 实时过滤: 输入停顿 150ms 后才查询一次，连续按键只触发一次 search_logs
+        self._filter_timer = QTimer(self); self._filter_timer.setSingleShot(True); self._filter_timer.setInterval(150)
+        self._filter_timer.timeout.connect(self.apply_filters)
+        # 过滤框输入时由校验器直接转为大写
+        for line_edit in (self.my_callsign_filter, self.callsign_filter, self.qsl_id_filter): line_edit.setValidator(UpperCaseValidator(line_edit))
+        self.my_callsign_filter.textChanged.connect(self._filter_timer.start)
+        self.callsign_filter.textChanged.connect(self._filter_timer.start)
         self.qsl_id_filter.returnPressed.connect(self.apply_filters)
         self.mode_filter.currentIndexChanged.connect(self.apply_filters); self.reset_button.clicked.connect(self.reset_filters)
         self.reorder_button.clicked.connect(self.reorder_logs)
-        self.card_in_button.clicked.connect(lambda: self.process_qsl_cards('RC')); self.card_out_button.clicked.connect(lambda: self.process_qsl_cards('TC'))
+        self.card_in_button.clicked.connect(functools.partial(self.process_qsl_cards, 'RC')); self.card_out_button.clicked.connect(functools.partial(self.process_qsl_cards, 'TC'))
         self.reprint_button.clicked.connect(self.reprint_label); self.write_nfc_button.clicked.connect(self.write_nfc_card) # Connect new button
         self.check_duplicates_button.clicked.connect(self.check_for_duplicates)
         self.delete_log_button.clicked.connect(self.delete_selected_logs); self.recycle_card_button.clicked.connect(self.recycle_selected_card)
@@ -1514,12 +1946,49 @@ class LogManagementWidget(QWidget):
 
     def load_initial_data(self):
         self.headers = ["ID", "我方呼号", "对方呼号", "日期", "时间", "TX 波段", "RX 波段", "TX 频率", "RX 频率", "模式", "已发?", "已收?", "备注"]
-        self.model = LogTableModel([], self.headers); self.table_view.setModel(self.model); self.table_view.setColumnWidth(0, 40); self.apply_filters()
+        self.model = LogTableModel([], self.headers); self.table_view.setModel(self.model)
+        # 所有列使用固定初始宽度 (可手动拖动)，避免 Qt 按内容逐行测量列宽；最后的备注列自动拉伸
+        self.table_view.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        for column, width in enumerate(LOG_TABLE_COLUMN_WIDTHS): self.table_view.setColumnWidth(column, width)
+        self.apply_filters()
     def apply_filters(self):
-        logs = self.db_manager.search_logs(my_callsign=self.my_callsign_filter.text(), station_callsign=self.callsign_filter.text(), mode=self.mode_filter.currentText(), qsl_id=self.qsl_id_filter.text())
+        # 立即刷新时取消尚未触发的延迟查询，避免重复查询
+        self._filter_timer.stop()
+        if self._cache_version != self.db_manager.data_version:
+            self._cached_search.cache_clear(); self._cache_version = self.db_manager.data_version
+        logs = self._cached_search(self.my_callsign_filter.text(), self.callsign_filter.text(), self.mode_filter.currentText(), self.qsl_id_filter.text())
+        # 刷新前记下滚动位置和选中的日志 ID，刷新后恢复，避免视图跳回顶部
+        v_bar = self.table_view.verticalScrollBar(); h_bar = self.table_view.horizontalScrollBar()
+        v_pos, h_pos = v_bar.value(), h_bar.value()
+        selection_model = self.table_view.selectionModel()
+        selected_ids = self.model.log_ids_at_rows(index.row() for index in selection_model.selectedRows())
         self.model.update_data(logs)
+        if selected_ids: self._restore_selection(selected_ids)
+        v_bar.setValue(v_pos); h_bar.setValue(h_pos)
+    def _restore_selection(self, selected_ids):
+        """按日志 ID 重新选中行，连续的行合并为一个区间，一次性提交给选择模型。"""
+        selection = QItemSelection(); last_col = self.model.columnCount(None) - 1
+        rows = self.model.rows_of_log_ids(selected_ids); i = 0
+        if rows: self.model.fetch_to(rows[-1]) # 刷新后选中行可能落在尚未接入视图的部分
+        while i < len(rows):
+            j = i
+            while j + 1 < len(rows) and rows[j + 1] == rows[j] + 1: j += 1
+            selection.select(self.model.index(rows[i], 0), self.model.index(rows[j], last_col)); i = j + 1
+        selection_model = self.table_view.selectionModel()
+        selection_model.blockSignals(True)
+        selection_model.select(selection, QItemSelectionModel.ClearAndSelect | QItemSelectionModel.Rows)
+        selection_model.blockSignals(False)
+        self.table_view.viewport().update() # 屏蔽信号后需手动刷新选中行的绘制
+    def _search(self, my_callsign, station_callsign, mode, qsl_id):
+        # 转为元组, 缓存中的结果不会被调用方修改
+        return tuple(self.db_manager.search_logs(my_callsign=my_callsign, station_callsign=station_callsign, mode=mode, qsl_id=qsl_id))
     def reset_filters(self):
-        self.my_callsign_filter.clear(); self.callsign_filter.clear(); self.qsl_id_filter.clear(); self.mode_filter.setCurrentIndex(0); self.apply_filters()
+        # 重置期间屏蔽各筛选控件的信号，只在最后查询一次
+        filter_widgets = (self.my_callsign_filter, self.callsign_filter, self.qsl_id_filter, self.mode_filter)
+        for w in filter_widgets: w.blockSignals(True)
+        self.my_callsign_filter.clear(); self.callsign_filter.clear(); self.qsl_id_filter.clear(); self.mode_filter.setCurrentIndex(0)
+        for w in filter_widgets: w.blockSignals(False)
+        self.apply_filters()
     def reorder_logs(self):
         reply = QMessageBox.question(self, "确认操作", "此操作将根据通联时间重新排列所有日志的序号，并刷新列表。\n您确定要继续吗？", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
@@ -1534,8 +2003,10 @@ class LogManagementWidget(QWidget):
         log_ids_to_process = []
         skipped_count = 0
 
-        for log_id in self.model.get_checked_log_ids():
-            log_details = self.db_manager.get_log_details(log_id)
+        checked_log_ids = self.model.get_checked_log_ids()
+        logs_by_id = self.db_manager.get_logs_by_ids(checked_log_ids)
+        for log_id in checked_log_ids:
+            log_details = logs_by_id.get(int(log_id))
             if not log_details: continue
 
             if direction == 'TC' and log_details['qsl_sent'] == 'Y':
@@ -1552,44 +2023,48 @@ class LogManagementWidget(QWidget):
 
         mode = "multi"
         if len(log_ids_to_process) > 1:
-            # BatchQslModeDialog 仍然保留，用于处理 QSL ID 的归并逻辑
-            dialog = BatchQslModeDialog(len(log_ids_to_process), self)
-            if dialog.exec() == QDialog.Accepted: mode = dialog.mode
-            else: return
+            # 批量模式选择仍然保留，用于处理 QSL ID 的归并逻辑
+            if self._batch_mode_dialog is None:
+                self._batch_mode_dialog = ChoiceDialog("选择卡片模式", "", [
+                    ("多卡模式 (为每条日志生成独立卡号)", "multi"), ("单卡模式 (为所有日志生成一个卡号)", "single")], self)
+            self._batch_mode_dialog.prompt_label.setText(f"您选择了 {len(log_ids_to_process)} 条日志，请选择处理模式：")
+            mode = self._batch_mode_dialog.ask()
+            if mode is None: return
 
         # --- 移除 DEFAULT_TO_LAYOUT_1 判定和 PrintLayoutDialog 调用 ---
         if direction == 'TC':
             # 发卡 (TC): 使用 layout 1 (QSO 数据 + QSLID 二维码)
-            layout_func = NewLayoutPrinter.generate_layout_1
+            layout_func = NewLayoutPrinter.generate_layout_1_batch
             #QMessageBox.information(self, "打印模式", f"发卡标签打印：(版式 1)")
         elif direction == 'RC':
             # 收卡 (RC): 使用 layout 2 (纯 QSLID 二维码)
-            layout_func = NewLayoutPrinter.generate_layout_2
+            layout_func = NewLayoutPrinter.generate_layout_2_batch
             #QMessageBox.information(self, "打印模式", f"收卡标签打印：(版式 2)")
         else:
             #QMessageBox.critical(self, "操作失败", "无法识别的操作方向。")
             return
             
-        self.run_print_job(layout_func, log_ids_to_process, direction, mode)
+        self.run_print_job(layout_func, log_ids_to_process, direction, mode, logs_by_id)
         # --- 打印逻辑结束 ---
         
         self.apply_filters()
         self.data_changed_signal.emit()
-    def run_print_job(self, print_function, log_ids, direction, mode):
+    def run_print_job(self, print_function, log_ids, direction, mode, logs_by_id=None):
         processed_count = 0
+        # 标签只用到 QSO 字段，建卡前批量取出的日志数据即可直接使用
+        if logs_by_id is None: logs_by_id = self.db_manager.get_logs_by_ids(log_ids)
         if mode == "single":
             qsl_id = QSL_ID_Generator.generate(self.db_manager, direction)
             if self.db_manager.add_qsl_card(qsl_id, log_ids, direction):
                 processed_count = len(log_ids)
-                log_data_list = [self.db_manager.get_log_details(log_id) for log_id in log_ids]
-                print_function(qsl_id, log_data_list, self)
+                log_data_list = [logs_by_id[int(log_id)] for log_id in log_ids]
+                print_function([(qsl_id, log_data_list)], self)
         else: # multi mode
-            for log_id in log_ids:
-                qsl_id = QSL_ID_Generator.generate(self.db_manager, direction)
-                if self.db_manager.add_qsl_card(qsl_id, [log_id], direction):
-                    processed_count += 1
-                    log_data_list = [self.db_manager.get_log_details(log_id)]
-                    print_function(qsl_id, log_data_list, self)
+            # 一次分配全部卡号、一个事务建完所有卡，再把全部标签交给一次批量生成 (一个 PDF、一次提示、一次打印)
+            qsl_ids = QSL_ID_Generator.generate_many(self.db_manager, direction, len(log_ids))
+            if self.db_manager.add_qsl_cards([(qsl_id, [log_id]) for qsl_id, log_id in zip(qsl_ids, log_ids)], direction):
+                processed_count = len(log_ids)
+                print_function([(qsl_id, [logs_by_id[int(log_id)]]) for qsl_id, log_id in zip(qsl_ids, log_ids)], self)
         
         if processed_count > 0:
             QMessageBox.information(self, "操作成功", f"成功为 {processed_count} 条日志生成卡片。")
@@ -1611,15 +2086,15 @@ class LogManagementWidget(QWidget):
             QMessageBox.information(self, "提示", "所选日志没有关联的QSL卡。")
             return
 
-        dialog = CardActionDialog("选择要补打的标签", cards, self)
-        if dialog.exec_() == QDialog.Accepted and dialog.selected_card_info:
+        selected_card_info = ChoiceDialog.choose_card(self, "选择要补打的标签", cards)
+        if selected_card_info:
             
             # --- 修正 1：将 sqlite3.Row 转换为 dict ---
             # 解决 AttributeError，并方便访问键值
-            selected_card_info_dict = dict(dialog.selected_card_info)
+            selected_card_info_dict = dict(selected_card_info)
             
             qsl_id_to_print = selected_card_info_dict['qsl_id']
-            # --- 关键修正 2：直接使用 CardActionDialog 返回的 'direction' 键 ---
+            # --- 关键修正 2：直接使用所选卡片记录中的 'direction' 键 ---
             card_direction = selected_card_info_dict.get('direction', '')
             
             logs_for_this_card = self.db_manager.get_logs_for_qsl_card(qsl_id_to_print)
@@ -1627,7 +2102,8 @@ class LogManagementWidget(QWidget):
                 QMessageBox.critical(self, "数据库错误", f"找不到卡号 {qsl_id_to_print} 关联的日志。")
                 return
 
-            log_data_list = [self.db_manager.get_log_details(lid['log_id']) for lid in logs_for_this_card]
+            logs_by_id = self.db_manager.get_logs_by_ids([lid['log_id'] for lid in logs_for_this_card])
+            log_data_list = [logs_by_id[lid['log_id']] for lid in logs_for_this_card if lid['log_id'] in logs_by_id]
 
             # --- 根据明确的 direction 自动选择版式 ---
             if card_direction == 'RC':
@@ -1656,9 +2132,9 @@ class LogManagementWidget(QWidget):
             QMessageBox.information(self, "无卡号", "所选日志没有关联的QSL卡号，无法写入。")
             return
 
-        dialog = CardActionDialog("选择要写入NFC的卡号", cards, self)
-        if dialog.exec_() == QDialog.Accepted and dialog.selected_card_info:
-            qsl_id_to_write = dialog.selected_card_info['qsl_id']
+        selected_card_info = ChoiceDialog.choose_card(self, "选择要写入NFC的卡号", cards)
+        if selected_card_info:
+            qsl_id_to_write = selected_card_info['qsl_id']
             nfc_dialog = NfcWriteDialog(qsl_id_to_write, self)
             nfc_dialog.exec_()
 
@@ -1666,67 +2142,54 @@ class LogManagementWidget(QWidget):
     def edit_selected_log(self, index):
         log_id = self.model.data(self.model.index(index.row(), 1), Qt.DisplayRole)
         my_callsign = self.model.data(self.model.index(index.row(), 2), Qt.DisplayRole)
-        dialog = LogDetailDialog(self.db_manager, my_callsign, log_id, self)
+        # 编辑对话框首次使用时创建，之后只切换日志并重新填充，不再重建整个控件树
+        if self._edit_dialog is None: self._edit_dialog = LogDetailDialog(self.db_manager, my_callsign, log_id, self)
+        else: self._edit_dialog.set_context(my_callsign, log_id)
+        dialog = self._edit_dialog
         if dialog.exec() == QDialog.Accepted:
             updated_data = dialog.get_data()
             if self.db_manager.update_log_entry(log_id, updated_data): QMessageBox.information(self, "成功", f"日志 (ID: {log_id}) 已更新。"); self.apply_filters()
             else: QMessageBox.critical(self, "错误", "无法更新日志。")
     def search_by_qsl_id(self, qsl_id):
-        self.qsl_id_filter.setText(qsl_id); self.apply_filters()
+        self.qsl_id_filter.setText(qsl_id.upper()); self.apply_filters()
     def check_for_duplicates(self):
-        QMessageBox.information(self, "开始查重", "将开始扫描整个数据库查找并合并重复日志，这可能需要一些时间。")
-        duplicate_sets = self.db_manager.find_all_duplicates()
-        if not duplicate_sets:
-            QMessageBox.information(self, "查重完成", "未发现重复的日志记录。")
-            return
-
-        merged_count = 0
-        for duplicate_set in duplicate_sets:
-            log_ids = sorted(list(duplicate_set))
-            master_log_id = log_ids[0]
-            master_log_data = dict(self.db_manager.get_log_details(master_log_id))
-
-            logs_to_delete = []
-
-            for i in range(1, len(log_ids)):
-                duplicate_log_id = log_ids[i]
-                duplicate_log_data_row = self.db_manager.get_log_details(duplicate_log_id)
-                if not duplicate_log_data_row: continue
-                duplicate_log_data = dict(duplicate_log_data_row)
-
-                needs_update = False
-                for key in duplicate_log_data.keys():
-                    if key in ['id', 'adif_blob']: continue
-                    new_value = duplicate_log_data.get(key)
-                    if new_value and not master_log_data.get(key):
-                        master_log_data[key] = new_value
-                        needs_update = True
-
-                new_comment = duplicate_log_data.get('comment', ''); old_comment = master_log_data.get('comment', '')
-                if new_comment and new_comment not in (old_comment or ""):
-                    master_log_data['comment'] = f"{old_comment or ''} | MERGED: {new_comment}".strip(" | "); needs_update = True
-
-                logs_to_delete.append(duplicate_log_id)
-
-            if needs_update:
-                self.db_manager.update_log_entry(master_log_id, master_log_data)
-
-            for log_id_to_delete in logs_to_delete:
-                self.db_manager.delete_log(log_id_to_delete)
-
-            merged_count += 1
-
-        QMessageBox.information(self, "合并完成", f"已自动合并 {merged_count} 组重复的日志记录。")
-        self.apply_filters()
+        if self._merge_job is not None: return
+        # 扫描与合并在后台线程进行，界面只显示进度
+        progress_dialog = QProgressDialog("正在扫描整个数据库查找并合并重复日志...", None, 0, 0, self)
+        progress_dialog.setWindowTitle("查重"); progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0); progress_dialog.setAutoClose(False); progress_dialog.setAutoReset(False)
+        job = DuplicateMergeJob(self.db_manager.db_file)
+
+        def on_progress(done, total):
+            progress_dialog.setMaximum(total); progress_dialog.setValue(done)
+
+        def on_finished(merged_count):
+            self._merge_job = None; progress_dialog.close()
+            # 任务使用独立连接写库，这里让查询缓存失效
+            self.db_manager.data_version += 1
+            if merged_count: QMessageBox.information(self, "合并完成", f"已自动合并 {merged_count} 组重复的日志记录。")
+            else: QMessageBox.information(self, "查重完成", "未发现重复的日志记录。")
+            self.apply_filters()
+
+        def on_failed(error):
+            self._merge_job = None; progress_dialog.close()
+            self.db_manager.data_version += 1
+            QMessageBox.critical(self, "查重失败", f"合并重复日志时出错: {error}")
+            self.apply_filters()
+
+        job.signals.progress.connect(on_progress)
+        job.signals.finished.connect(on_finished)
+        job.signals.failed.connect(on_failed)
+        self._merge_job = job # 保持引用直到回调执行
+        progress_dialog.show()
+        QThreadPool.globalInstance().start(job)
     def delete_selected_logs(self):
         log_ids = self.model.get_checked_log_ids()
         if not log_ids: QMessageBox.warning(self, "操作提示", "请先在表格中勾选要删除的日志。"); return
 
         reply = QMessageBox.question(self, "确认删除", f"您确定要永久删除选中的 {len(log_ids)} 条日志吗？\n此操作不可恢复！", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            deleted_count = 0
-            for log_id in log_ids:
-                if self.db_manager.delete_log(log_id): deleted_count += 1
+            deleted_count = self.db_manager.delete_logs(log_ids)
             QMessageBox.information(self, "操作完成", f"成功删除 {deleted_count} 条日志。")
             self.apply_filters(); self.data_changed_signal.emit()
     def recycle_selected_card(self):
@@ -1737,9 +2200,9 @@ class LogManagementWidget(QWidget):
         cards = self.db_manager.get_qsl_cards_for_log(log_id)
         if not cards: QMessageBox.information(self, "提示", "该日志没有关联的QSL卡，无需回收。"); return
 
-        dialog = CardActionDialog("选择要回收的卡号", cards, self)
-        if dialog.exec() == QDialog.Accepted and dialog.selected_card_info:
-            direction = dialog.selected_card_info['direction']
+        selected_card_info = ChoiceDialog.choose_card(self, "选择要回收的卡号", cards)
+        if selected_card_info:
+            direction = selected_card_info['direction']
             if self.db_manager.recycle_qsl_card(log_id, direction):
                 QMessageBox.information(self, "操作成功", f"成功回收该日志的 {direction} 卡号。")
                 self.apply_filters(); self.data_changed_signal.emit()
@@ -1769,7 +2232,7 @@ class HardwareWidget(QWidget):
         input_zone = QGroupBox("手动输入")
         input_layout = QVBoxLayout(input_zone)
         self.manual_input = QLineEdit(); self.manual_input.setPlaceholderText("输入QSL卡号后按回车查询...")
-        self.manual_input.textChanged.connect(lambda text: self.manual_input.setText(text.upper()))
+        self.manual_input.setValidator(UpperCaseValidator(self.manual_input))
         self.manual_input.returnPressed.connect(self.search_manual_code)
         input_layout.addWidget(self.manual_input)
 
@@ -1813,20 +2276,23 @@ class HardwareWidget(QWidget):
             self.results_browser.setHtml(f"<h3>未找到与 QSL 卡号 '{qsl_id_prefix}' 相关的日志。</h3>")
             return
 
-        full_html = ""
-        for card_row in matching_qsl_cards:
-            full_qsl_id = card_row['qsl_id']
-            full_html += f"<h3>QSL 卡号: {full_qsl_id}</h3>"
+        # 一次查询取出所有匹配卡号关联的日志 ID，再一次批量查询全部日志详情，代替逐卡、逐条查询
+        log_ids_by_card = self.db_manager.get_logs_for_qsl_cards(card_row['qsl_id'] for card_row in matching_qsl_cards)
+        logs_by_id = self.db_manager.get_logs_by_ids({log_id for log_ids in log_ids_by_card.values() for log_id in log_ids})
 
-            logs_for_this_card = self.db_manager.get_logs_for_qsl_card(full_qsl_id)
+        # 各段 HTML 先放入列表，最后一次 join，避免在循环中反复拼接长字符串
+        card_htmls = []
+        for full_qsl_id, logs_for_this_card in log_ids_by_card.items():
+            parts = [f"<h3>QSL 卡号: {full_qsl_id}</h3>"]
 
             if logs_for_this_card:
-                full_html += "<p><b>关联的通联日志:</b></p>"
-                for i, log_row in enumerate(logs_for_this_card):
-                    if i > 0: full_html += "<hr>"
-                    log_details = dict(self.db_manager.get_log_details(log_row['log_id']))
+                parts.append("<p><b>关联的通联日志:</b></p>")
+                for i, log_id in enumerate(logs_for_this_card):
+                    if i > 0: parts.append("<hr>")
+                    log_details = logs_by_id.get(log_id)
                     if log_details:
-                        details_html = f"""
+                        log_details = dict(log_details)
+                        parts.append(f"""
                                 <p>
                                 <b>对方呼号:</b> {log_details.get('station_callsign', '')}<br>
                                 <b>我方呼号:</b> {log_details.get('my_callsign', '')}<br>
@@ -1834,20 +2300,20 @@ class HardwareWidget(QWidget):
                                 <b>频率/波段:</b> {log_details.get('freq', 'N/A')} MHz / {log_details.get('band', 'N/A')}<br>
                                 <b>模式:</b> {log_details.get('mode', '')} {log_details.get('submode', '') or ''}<br>
                                 <b>信号报告 (S/R):</b> {log_details.get('rst_sent', '')} / {log_details.get('rst_rcvd', '')}<br>
-                            """
+                            """)
                         if log_details.get('sat_name'):
-                            details_html += f"<b>卫星:</b> {log_details['sat_name']}<br>"
+                            parts.append(f"<b>卫星:</b> {log_details['sat_name']}<br>")
                         if log_details.get('comment'):
-                                details_html += f"<b>备注:</b> {log_details['comment']}"
+                            parts.append(f"<b>备注:</b> {log_details['comment']}")
 
-                        details_html += "</p>"
-                        full_html += details_html
+                        parts.append("</p>")
 
             else:
-                full_html += "<p>无关联的通联日志。</p>"
-            full_html += "<hr style='border: 1px solid #7f8c8d;'>"
+                parts.append("<p>无关联的通联日志。</p>")
+            card_htmls.append("".join(parts))
 
-        self.results_browser.setHtml(full_html.removesuffix("<hr style='border: 1px solid #7f8c8d;'>"))
+        # 卡与卡之间用分隔线隔开
+        self.results_browser.setHtml("<hr style='border: 1px solid #7f8c8d;'>".join(card_htmls))
 
     def enter_view(self):
         self.manual_input.setFocus()
@@ -1861,18 +2327,41 @@ class HardwareWidget(QWidget):
         pass
 
 # --- Main Application Window ---
+class HtmlItemDelegate(QStyledItemDelegate):
+    """用同一个 QTextDocument 绘制所有列表项的富文本 (DisplayRole 中的 HTML)，无需为每行创建 QLabel。"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._doc = QTextDocument(self)
+
+    def _layout(self, option, index):
+        opt = QStyleOptionViewItem(option); self.initStyleOption(opt, index)
+        self._doc.setDefaultFont(opt.font); self._doc.setHtml(opt.text)
+        return opt
+
+    def paint(self, painter, option, index):
+        opt = self._layout(option, index)
+        opt.text = "" # 背景/选中态交给样式绘制，文字由 _layout 中排好的 QTextDocument 绘制
+        style = opt.widget.style() if opt.widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, opt, painter, opt.widget)
+        y_offset = max(0, (opt.rect.height() - self._doc.size().height()) / 2)
+        painter.save(); painter.translate(opt.rect.left(), opt.rect.top() + y_offset)
+        self._doc.drawContents(painter, QRectF(0, 0, opt.rect.width(), opt.rect.height())); painter.restore()
+
+    def sizeHint(self, option, index):
+        self._layout(option, index)
+        return QSize(int(self._doc.idealWidth()), int(self._doc.size().height()))
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         os.makedirs("database", exist_ok=True)
         self.db_manager = DatabaseManager(DB_FILE); self.adif_handler = ADIF_Handler()
+        self._import_job = None # 正在后台运行的 ADIF 导入任务
         self.init_database(); self.init_ui()
     def init_ui(self):
         self.setWindowTitle("QSL Card Manager"); self.setGeometry(100, 100, 1200, 800)
         self.statusBar().showMessage("准备就绪")
-        try:
-            with open(STYLE_SHEET_FILE, "r", encoding="utf-8") as f: self.setStyleSheet(f.read())
-        except FileNotFoundError: print(f"Warning: Stylesheet '{STYLE_SHEET_FILE}' not found.")
+        self.setStyleSheet(STYLE_SHEET)
         self.central_widget = QWidget(); self.setCentralWidget(self.central_widget)
         self.main_layout = QVBoxLayout(self.central_widget); self.stacked_widget = QStackedWidget()
         self.main_layout.addWidget(self.stacked_widget); self.create_dashboard_view()
@@ -1935,21 +2424,22 @@ class MainWindow(QMainWindow):
         self.total_logs_label = QLabel("0"); self.sent_cards_label = QLabel("0"); self.received_cards_label = QLabel("0")
         stats_form.addRow("总日志数:", self.total_logs_label); stats_form.addRow("已发卡片:", self.sent_cards_label); stats_form.addRow("已收卡片:", self.received_cards_label)
         activity_group_label = QLabel("近期动态"); activity_group_label.setObjectName("statsHeader")
-        self.activity_list = QListWidget()
+        self.activity_list = QListWidget(); self.activity_list.setItemDelegate(HtmlItemDelegate(self.activity_list))
         stats_vbox.addWidget(stats_group_label); stats_vbox.addLayout(stats_form); stats_vbox.addWidget(activity_group_label); stats_vbox.addWidget(self.activity_list)
         main_hbox.addWidget(stats_widget, 1) # Changed stretch factor
         self.stacked_widget.addWidget(self.dashboard_view); self.update_dashboard_stats()
 
     def update_dashboard_stats(self):
-        log_count = self.db_manager.get_total_log_count(); sent_count = self.db_manager.get_qsl_count("TC"); rcvd_count = self.db_manager.get_qsl_count("RC")
+        log_count, sent_count, rcvd_count = self.db_manager.get_dashboard_counts()
         self.total_logs_label.setText(str(log_count)); self.sent_cards_label.setText(str(sent_count)); self.received_cards_label.setText(str(rcvd_count))
         self.activity_list.clear()
         recent_activity = self.db_manager.get_recent_qsl_activity()
+        # 先生成全部条目文本，再一次 addItems 填入 (富文本由 HtmlItemDelegate 绘制)
+        item_texts = []
         for activity in recent_activity:
-            direction = "收到" if activity['direction'] == 'RC' else "寄出"; color = "#27ae60" if activity['direction'] == 'RC' else "#e67e22"
-            item_text = f"<b>{direction}</b> {activity['station_callsign']} 的卡片"
-            list_item = QListWidgetItem(); label = QLabel(item_text); label.setStyleSheet(f"color: {color};")
-            self.activity_list.addItem(list_item); self.activity_list.setItemWidget(list_item, label)
+            direction, color = ("收到", "#27ae60") if activity['direction'] == 'RC' else ("寄出", "#e67e22")
+            item_texts.append(f"<span style=\"color: {color};\"><b>{direction}</b> {activity['station_callsign']} 的卡片</span>")
+        self.activity_list.addItems(item_texts)
     def init_database(self): self.db_manager.initialize_database(); print("Database initialized successfully.")
     def on_address_label_clicked(self):
         dialog = AddressLabelDialog(self)
@@ -1970,41 +2460,36 @@ class MainWindow(QMainWindow):
                 self.update_dashboard_stats()
     def on_log_manage_clicked(self): self.log_management_view.load_initial_data(); self.stacked_widget.setCurrentWidget(self.log_management_view)
     def on_import_clicked(self):
+        if self._import_job is not None: return
         file_path, _ = QFileDialog.getOpenFileName(self, "选择ADIF日志文件", "", "ADIF Files (*.adi);;All Files (*)")
         if not file_path: return
-        try:
-            qsos, _ = adif_io.read_from_file(file_path); imported_count, updated_count, duplicate_count = 0, 0, 0
-            my_configured_callsigns = self.db_manager.get_all_my_callsigns(); primary_callsign = ConfigManager.get_config("primary_callsign")
-            for qso in qsos:
-                band = qso.get('BAND', '')
-                if not all(k in qso for k in ['CALL', 'QSO_DATE', 'TIME_ON', 'BAND']): continue
-
-                existing_log_id = self.db_manager.log_exists(qso['CALL'], qso['QSO_DATE'], qso['TIME_ON'], band, qso.get('MODE'))
-                if existing_log_id:
-                    existing_log = self.db_manager.get_log_details(existing_log_id)
-                    merged_data = dict(existing_log); needs_update = False
-
-                    new_log_data = {'station_callsign': qso.get('CALL'), 'qso_date': qso.get('QSO_DATE'), 'time_on': qso.get('TIME_ON'), 'band': band, 'band_rx': qso.get('BAND_RX'), 'freq': qso.get('FREQ'), 'freq_rx': qso.get('FREQ_RX'), 'mode': qso.get('MODE'), 'rst_sent': qso.get('RST_SENT'), 'rst_rcvd': qso.get('RST_RCVD'), 'comment': qso.get('COMMENT', ''), 'my_callsign': qso.get('OPERATOR', primary_callsign), 'submode': qso.get('SUBMODE'), 'sat_name': qso.get('SAT_NAME'), 'prop_mode': qso.get('PROP_MODE')}
-
-                    for key, new_value in new_log_data.items():
-                        if new_value and not merged_data.get(key):
-                            merged_data[key] = new_value; needs_update = True
-
-                    new_comment = new_log_data.get('comment', ''); old_comment = merged_data.get('comment', '')
-                    if new_comment and new_comment not in (old_comment or ""):
-                        merged_data['comment'] = f"{old_comment or ''} | IMPORTED: {new_comment}".strip(" | "); needs_update = True
-
-                    if needs_update:
-                        self.db_manager.update_log_entry(existing_log_id, merged_data); updated_count += 1
-                    else: duplicate_count += 1
-                else:
-                    operator = qso.get('OPERATOR', '').upper(); my_call = operator if operator in my_configured_callsigns else primary_callsign
-                    log_data = { 'station_callsign': qso.get('CALL'), 'qso_date': qso.get('QSO_DATE'), 'time_on': qso.get('TIME_ON'), 'band': band, 'band_rx': qso.get('BAND_RX'), 'freq': qso.get('FREQ'), 'freq_rx': qso.get('FREQ_RX'), 'mode': qso.get('MODE'), 'rst_sent': qso.get('RST_SENT'), 'rst_rcvd': qso.get('RST_RCVD'), 'comment': qso.get('COMMENT', ''), 'my_callsign': my_call, 'submode': qso.get('SUBMODE'), 'sat_name': qso.get('SAT_NAME'), 'prop_mode': qso.get('PROP_MODE') }
-                    self.db_manager.add_log_entry(log_data); imported_count += 1
+        # 解析、查重与写库在后台线程进行；进度框为模态，导入期间界面不会再写数据库
+        progress_dialog = QProgressDialog("正在导入 ADIF 日志...", None, 0, 0, self)
+        progress_dialog.setWindowTitle("导入日志"); progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0); progress_dialog.setAutoClose(False); progress_dialog.setAutoReset(False)
+        job = AdifImportJob(self.db_manager.db_file, file_path, ConfigManager.get_config("primary_callsign"))
+
+        def on_progress(done, total):
+            progress_dialog.setMaximum(total); progress_dialog.setValue(done)
+
+        def on_finished(imported_count, updated_count, duplicate_count):
+            self._import_job = None; progress_dialog.close()
+            # 任务使用独立连接写库，这里让查询缓存失效
+            self.db_manager.data_version += 1
             QMessageBox.information(self, "导入完成", f"成功导入 {imported_count} 条新日志。\n更新合并 {updated_count} 条已有日志。\n发现 {duplicate_count} 条完全重复日志已跳过。")
             if self.stacked_widget.currentWidget() == self.log_management_view: self.log_management_view.apply_filters()
             self.update_dashboard_stats()
-        except Exception as e: QMessageBox.critical(self, "导入失败", f"无法解析或处理ADIF文件。\n错误: {e}")
+
+        def on_failed(error):
+            self._import_job = None; progress_dialog.close()
+            QMessageBox.critical(self, "导入失败", error)
+
+        job.signals.progress.connect(on_progress)
+        job.signals.finished.connect(on_finished)
+        job.signals.failed.connect(on_failed)
+        self._import_job = job # 保持引用直到回调执行
+        progress_dialog.show()
+        QThreadPool.globalInstance().start(job)
     def on_scan_clicked(self):
         self.hardware_view.enter_view()
         self.stacked_widget.setCurrentWidget(self.hardware_view)
@@ -2013,7 +2498,7 @@ class MainWindow(QMainWindow):
         dialog = QSLInventoryUpdateDialog(self.db_manager, self)
         dialog.exec_()    
     def on_settings_clicked(self): dialog = SettingsDialog(self.db_manager, self); dialog.data_changed.connect(self.update_dashboard_stats); dialog.exec()
-    def closeEvent(self, event): self.hardware_view.closeEvent(event); self.db_manager.close(); event.accept()
+    def closeEvent(self, event): self.hardware_view.closeEvent(event); NFCWriter.close_port(); self.db_manager.close(); event.accept()
     def search_by_qsl_id(self, qsl_id):
         self.stacked_widget.setCurrentWidget(self.log_management_view); self.log_management_view.search_by_qsl_id(qsl_id)
 
@@ -2023,122 +2508,255 @@ class DatabaseManager:
         db_dir = os.path.dirname(db_file)
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir)
-        self.conn = sqlite3.connect(db_file); self.conn.row_factory = sqlite3.Row; self.cursor = self.conn.cursor()
+        self.db_file = db_file
+        # 语句缓存调大到 256 条：查询字符串相同即可复用已编译的语句，免去重复解析
+        self.conn = sqlite3.connect(db_file, cached_statements=256); self.conn.row_factory = sqlite3.Row; self.cursor = self.conn.cursor()
+        # WAL + NORMAL: 提交时无需每次完整 fsync, 批量写入明显更快, 断电时最多丢失最后一个事务
+        # (WAL 需要在数据库所在目录创建 -wal/-shm 文件, 该目录必须可写)
+        # 临时表放内存, 页缓存 64MB, 读取走 256MB mmap 以减少 read 系统调用
+        for pragma in ("journal_mode=WAL", "synchronous=NORMAL", "temp_store=MEMORY", "cache_size=-65536", "mmap_size=268435456"):
+            self.cursor.execute(f"PRAGMA {pragma}")
+        # 文件系统不支持 WAL (如部分网络盘) 时 SQLite 会静默保留原日志模式，此时提示一次
+        journal_mode = self.fetch_one("PRAGMA journal_mode")[0]
+        if journal_mode.lower() != "wal": print(f"Warning: SQLite WAL mode unavailable, using '{journal_mode}' journal.")
+        # 每次成功提交写操作后递增，供界面层判断查询缓存是否失效
+        self.data_version = 0; self._in_transaction = False; self.fts_enabled = False
+        self._cached_counts = {}; self._counts_version = 0; self._callsigns = None
     def execute_query(self, query, params=()):
-        try: self.cursor.execute(query, params); self.conn.commit(); return True
-        except sqlite3.Error as e: print(f"Database error: {e}"); self.conn.rollback(); return False
+        # 处于 transaction() 块中时不逐条提交，由块结束时统一提交
+        try:
+            self.cursor.execute(query, params)
+            if not self._in_transaction: self.conn.commit(); self.data_version += 1
+            return True
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            if not self._in_transaction: self.conn.rollback()
+            return False
+    @contextlib.contextmanager
+    def transaction(self):
+        """将块内的多次写操作合并为一个事务：正常结束时提交一次，抛出异常时整体回滚。可嵌套 (内层无操作)。"""
+        if self._in_transaction: yield; return
+        self._in_transaction = True
+        try:
+            self.cursor.execute("BEGIN"); yield
+            self.conn.commit(); self.data_version += 1
+        except Exception:
+            self.conn.rollback(); raise
+        finally: self._in_transaction = False
     def fetch_one(self, query, params=()): self.cursor.execute(query, params); return self.cursor.fetchone()
     def fetch_all(self, query, params=()): self.cursor.execute(query, params); return self.cursor.fetchall()
-    def get_all_my_callsigns(self): return [row['callsign'] for row in self.fetch_all("SELECT callsign FROM callsigns")]
-    def add_callsign(self, callsign): return self.execute_query("INSERT OR IGNORE INTO callsigns (callsign) VALUES (?)", (callsign,))
-    def delete_callsign(self, callsign): return self.execute_query("DELETE FROM callsigns WHERE callsign = ?", (callsign,))
-    def add_log_entry(self, log_data):
-        log_data['adif_blob'] = json.dumps(log_data)
-        # 增加 qsl_sent_date 和 qsl_rcvd_date
-        query = "INSERT INTO logs (my_callsign, station_callsign, qso_date, time_on, band, band_rx, freq, freq_rx, mode, rst_sent, rst_rcvd, comment, adif_blob, submode, sat_name, prop_mode, qsl_sent_date, qsl_rcvd_date) VALUES (:my_callsign, :station_callsign, :qso_date, :time_on, :band, :band_rx, :freq, :freq_rx, :mode, :rst_sent, :rst_rcvd, :comment, :adif_blob, :submode, :sat_name, :prop_mode, :qsl_sent_date, :qsl_rcvd_date)"
-        # 确保字典中有这两个键，防止报错
+    def get_all_my_callsigns(self):
+        # 呼号表只在 add_callsign / delete_callsign 中改变，首次查询后缓存，之后不再访问数据库
+        if self._callsigns is None: self._callsigns = tuple(row['callsign'] for row in self.fetch_all("SELECT callsign FROM callsigns"))
+        return list(self._callsigns)
+    def add_callsign(self, callsign): self._callsigns = None; return self.execute_query("INSERT OR IGNORE INTO callsigns (callsign) VALUES (?)", (callsign,))
+    def delete_callsign(self, callsign): self._callsigns = None; return self.execute_query("DELETE FROM callsigns WHERE callsign = ?", (callsign,))
+    LOG_INSERT_QUERY = "INSERT INTO logs (my_callsign, station_callsign, qso_date, time_on, band, band_rx, freq, freq_rx, mode, rst_sent, rst_rcvd, comment, adif_blob, submode, sat_name, prop_mode, qsl_sent_date, qsl_rcvd_date) VALUES (:my_callsign, :station_callsign, :qso_date, :time_on, :band, :band_rx, :freq, :freq_rx, :mode, :rst_sent, :rst_rcvd, :comment, :adif_blob, :submode, :sat_name, :prop_mode, :qsl_sent_date, :qsl_rcvd_date)"
+    LOG_UPDATE_QUERY = "UPDATE logs SET station_callsign=:station_callsign, qso_date=:qso_date, time_on=:time_on, band=:band, band_rx=:band_rx, freq=:freq, freq_rx=:freq_rx, mode=:mode, rst_sent=:rst_sent, rst_rcvd=:rst_rcvd, comment=:comment, adif_blob=:adif_blob, submode=:submode, sat_name=:sat_name, prop_mode=:prop_mode, qsl_sent_date=:qsl_sent_date, qsl_rcvd_date=:qsl_rcvd_date WHERE id=:log_id"
+    # logs 表的所有列；这些字段已按列存储，不再重复写入 adif_blob
+    LOG_COLUMNS = frozenset(("id", "sort_id", "my_callsign", "station_callsign", "qso_date", "time_on", "band", "band_rx", "freq", "freq_rx", "mode", "submode",
+                             "rst_sent", "rst_rcvd", "comment", "adif_blob", "qsl_sent", "qsl_rcvd", "sat_name", "prop_mode", "qsl_sent_date", "qsl_rcvd_date"))
+    @staticmethod
+    def _prepare_log_data(log_data):
+        # adif_blob 只保存没有对应列的额外字段 (通常没有，存 NULL)；原先整行转 JSON，合并时还会把旧 blob 嵌套进新 blob
+        extra_fields = {key: value for key, value in log_data.items() if key not in DatabaseManager.LOG_COLUMNS}
+        log_data['adif_blob'] = json.dumps(extra_fields) if extra_fields else None
+        # 确保字典中有 qsl_sent_date 和 qsl_rcvd_date 两个键，防止报错
         log_data.setdefault('qsl_sent_date', None)
         log_data.setdefault('qsl_rcvd_date', None)
-        
-        if self.execute_query(query, log_data):
-            log_id = self.cursor.lastrowid
-            self.execute_query("UPDATE logs SET sort_id = ? WHERE id = ?", (log_id, log_id))
-            return log_id
+        return log_data
+    def add_log_entry(self, log_data):
+        # sort_id 由 logs_default_sort_id 触发器在插入时填为 id，无需再单独 UPDATE/提交一次
+        if self.execute_query(self.LOG_INSERT_QUERY, self._prepare_log_data(log_data)): return self.cursor.lastrowid
         return None
     def update_log_entry(self, log_id, log_data):
-        log_data['adif_blob'] = json.dumps(log_data); log_data['log_id'] = log_id
-        # 增加 qsl_sent_date 和 qsl_rcvd_date 的更新
-        query = "UPDATE logs SET station_callsign=:station_callsign, qso_date=:qso_date, time_on=:time_on, band=:band, band_rx=:band_rx, freq=:freq, freq_rx=:freq_rx, mode=:mode, rst_sent=:rst_sent, rst_rcvd=:rst_rcvd, comment=:comment, adif_blob=:adif_blob, submode=:submode, sat_name=:sat_name, prop_mode=:prop_mode, qsl_sent_date=:qsl_sent_date, qsl_rcvd_date=:qsl_rcvd_date WHERE id=:log_id"
-        # 确保字典中有这两个键
-        log_data.setdefault('qsl_sent_date', None)
-        log_data.setdefault('qsl_rcvd_date', None)
-        return self.execute_query(query, log_data)
-    def add_qsl_card(self, qsl_id, log_ids: list, direction):
+        log_data = self._prepare_log_data(log_data); log_data['log_id'] = log_id
+        return self.execute_query(self.LOG_UPDATE_QUERY, log_data)
+    # logs 表的二级索引 {名称: 建立语句}
+    LOG_INDEXES = {
+        # 查重键 (呼号, 日期, 波段, 模式) + time_on：导入时按呼号前缀查找，
+        # find_all_duplicates 的 GROUP BY 与逐组 ORDER BY time_on 也直接按索引顺序完成
+        "idx_logs_dupkey": "CREATE INDEX IF NOT EXISTS idx_logs_dupkey ON logs(UPPER(station_callsign), qso_date, UPPER(band), UPPER(mode), time_on)",
+        "idx_logs_sort": "CREATE INDEX IF NOT EXISTS idx_logs_sort ON logs(sort_id)",           # search_logs 排序
+        "idx_logs_time": "CREATE INDEX IF NOT EXISTS idx_logs_time ON logs(qso_date, time_on)",  # reorder_logs_by_time
+        "idx_logs_mode": "CREATE INDEX IF NOT EXISTS idx_logs_mode ON logs(mode)",
+    }
+    BULK_INDEX_MIN_ROWS = 5000 # 新增日志达到此数量且不少于现有日志数时，导入期间暂停维护二级索引
+    ANALYZE_MIN_ROWS = 1000    # 初始化时日志超过此数量且没有统计信息才执行 ANALYZE
+    def import_log_entries(self, new_logs, updated_logs):
+        """
+        批量导入日志：新增 (new_logs 列表) 与合并更新 ({log_id: log_data}) 在同一事务内用 executemany 完成，
+        避免逐条提交。任一语句失败则整体回滚。
+        大批量导入时先删除 logs 的二级索引、写完后一次性重建，代替逐行维护各个 B 树；
+        查重数据在导入前已一次取出，写入期间不依赖这些索引。
+        """
+        defer_indexes = len(new_logs) >= max(self.BULK_INDEX_MIN_ROWS, self.get_total_log_count())
+        try:
+            # 用 transaction() 显式 BEGIN，保证 DROP/CREATE INDEX 与数据写入同属一个事务，失败时索引随之恢复
+            with self.transaction():
+                if defer_indexes:
+                    for name in self.LOG_INDEXES: self.cursor.execute(f"DROP INDEX IF EXISTS {name}")
+                # 以生成器逐行提供参数，不在内存中另建一份完整的参数列表；新日志的 sort_id 由触发器填写
+                self.cursor.executemany(self.LOG_INSERT_QUERY, (self._prepare_log_data(d) for d in new_logs))
+                self.cursor.executemany(self.LOG_UPDATE_QUERY, (dict(self._prepare_log_data(d), log_id=log_id) for log_id, d in updated_logs.items()))
+                if defer_indexes:
+                    for query in self.LOG_INDEXES.values(): self.cursor.execute(query)
+            # 大批量导入后更新查询规划器统计信息
+            self.cursor.execute("PRAGMA optimize")
+            return True
+        except sqlite3.Error as e: print(f"Database error during import: {e}"); return False
+    def add_qsl_card(self, qsl_id, log_ids: list, direction): return self.add_qsl_cards([(qsl_id, log_ids)], direction)
+    def add_qsl_cards(self, cards, direction):
+        """批量建卡：cards 为 [(qsl_id, log_ids), ...]，全部卡片在同一事务内写入，任一失败整体回滚。"""
+        cards = [(qsl_id, list(log_ids)) for qsl_id, log_ids in cards]
+        for qsl_id, log_ids in cards:
+            if not log_ids: print(f"Error adding QSL card: no logs given for {qsl_id}"); return False # 空列表会生成非法的 IN ()
+        if not cards: return False
+        # 收卡 (RC) 更新 qsl_rcvd，发卡更新 qsl_sent，并设置对应日期
+        status_field, date_field = ('qsl_rcvd', 'qsl_rcvd_date') if direction == 'RC' else ('qsl_sent', 'qsl_sent_date')
+        all_log_ids = [log_id for _, log_ids in cards for log_id in log_ids]
         try:
             now = datetime.datetime.now().isoformat()
             current_date_str = datetime.datetime.now().strftime('%Y%m%d') # ADIF 格式日期
-            
-            self.cursor.execute("INSERT INTO qsl_cards (qsl_id, direction, status, created_at) VALUES (?, ?, ?, ?)", (qsl_id, direction, 'In Stock', now))
-            for log_id in log_ids: self.cursor.execute("INSERT INTO qsl_log_link (qsl_id, log_id) VALUES (?, ?)", (qsl_id, log_id))
-            
-            if direction == 'RC':
-                # 收卡：更新状态为 Y，并设置收卡时间
-                placeholders = ', '.join('?' for _ in log_ids)
-                params = [current_date_str] + log_ids
-                self.cursor.execute(f"UPDATE logs SET qsl_rcvd = 'Y', qsl_rcvd_date = ? WHERE id IN ({placeholders})", params)
-            else:
-                # 发卡：更新状态为 Y，并设置发卡时间
-                placeholders = ', '.join('?' for _ in log_ids)
-                params = [current_date_str] + log_ids
-                self.cursor.execute(f"UPDATE logs SET qsl_sent = 'Y', qsl_sent_date = ? WHERE id IN ({placeholders})", params)
-                
-            self.conn.commit(); return True
-        except sqlite3.Error as e: print(f"Error adding QSL card: {e}"); self.conn.rollback(); return False
+            # 建卡、批量写入关联、批量更新日志状态在同一事务内完成，只提交一次
+            with self.transaction():
+                self.cursor.executemany("INSERT INTO qsl_cards (qsl_id, direction, status, created_at) VALUES (?, ?, ?, ?)", ((qsl_id, direction, 'In Stock', now) for qsl_id, _ in cards))
+                self.cursor.executemany("INSERT INTO qsl_log_link (qsl_id, log_id) VALUES (?, ?)", ((qsl_id, log_id) for qsl_id, log_ids in cards for log_id in log_ids))
+                for start in range(0, len(all_log_ids), 900): # 按 900 个一组，避免超过 SQLite 变量上限
+                    chunk = all_log_ids[start:start + 900]
+                    self.cursor.execute(f"UPDATE logs SET {status_field} = 'Y', {date_field} = ? WHERE id IN ({','.join('?' * len(chunk))})", [current_date_str] + chunk)
+            return True
+        except sqlite3.Error as e: print(f"Error adding QSL card: {e}"); return False
     def get_log_details(self, log_id): return self.fetch_one("SELECT * FROM logs WHERE id = ?", (log_id,))
+    def get_logs_by_ids(self, log_ids):
+        """一次 IN 查询取出多条日志，返回 {id: row}；按 900 个一组分批，避免超过 SQLite 变量上限。"""
+        log_ids = list(log_ids); logs_by_id = {}
+        for start in range(0, len(log_ids), 900):
+            chunk = log_ids[start:start + 900]
+            for row in self.fetch_all(f"SELECT * FROM logs WHERE id IN ({','.join('?' * len(chunk))})", chunk): logs_by_id[row['id']] = row
+        return logs_by_id
     def get_qsl_cards_for_log(self, log_id): return self.fetch_all("SELECT q.* FROM qsl_cards q JOIN qsl_log_link ql ON q.qsl_id = ql.qsl_id WHERE ql.log_id = ?", (log_id,))
     def get_logs_for_qsl_card(self, qsl_id): return self.fetch_all("SELECT log_id FROM qsl_log_link WHERE qsl_id = ?", (qsl_id,))
+    def get_logs_for_qsl_cards(self, qsl_ids):
+        """一次 IN 查询取出多张卡关联的日志 ID，返回 {qsl_id: [log_id, ...]}；按 900 个一组分批。"""
+        qsl_ids = list(qsl_ids); log_ids_by_card = {qsl_id: [] for qsl_id in qsl_ids}
+        for start in range(0, len(qsl_ids), 900):
+            chunk = qsl_ids[start:start + 900]
+            for row in self.fetch_all(f"SELECT qsl_id, log_id FROM qsl_log_link WHERE qsl_id IN ({','.join('?' * len(chunk))})", chunk): log_ids_by_card[row['qsl_id']].append(row['log_id'])
+        return log_ids_by_card
     def get_logs_for_qsl_id_prefix(self, qsl_id_prefix):
-        return self.fetch_all("SELECT DISTINCT qsl_id FROM qsl_cards WHERE UPPER(qsl_id) LIKE ?", (f"{qsl_id_prefix.upper()}%",))
-
-    def get_total_log_count(self): return self.fetch_one("SELECT COUNT(id) FROM logs")[0]
-    def get_qsl_count(self, direction): return self.fetch_one("SELECT COUNT(qsl_id) FROM qsl_cards WHERE direction = ?", (direction,))[0]
-    def get_recent_qsl_activity(self, limit=10): return self.fetch_all("SELECT q.direction, l.station_callsign FROM qsl_cards q JOIN qsl_log_link ql ON q.qsl_id = ql.qsl_id JOIN logs l ON ql.log_id = l.id GROUP BY q.qsl_id ORDER BY q.created_at DESC LIMIT ?", (limit,))
+        # qsl_id 是主键本身唯一，无需 DISTINCT (否则要额外建临时 B 树去重)；前缀 LIKE 走 idx_cards_id_nocase 范围查找
+        return self.fetch_all("SELECT qsl_id FROM qsl_cards WHERE qsl_id LIKE ?", (f"{qsl_id_prefix.upper()}%",))
+
+    def _counts_cache(self):
+        # 首页统计数在两次写入之间不会变化：按 data_version 缓存，任何写入提交后自动失效，刷新首页不再重复 COUNT 全表
+        if self._counts_version != self.data_version: self._cached_counts.clear(); self._counts_version = self.data_version
+        return self._cached_counts
+    def _cached_count(self, key, query, params=()):
+        cache = self._counts_cache()
+        if key not in cache: cache[key] = self.fetch_one(query, params)[0]
+        return cache[key]
+    def get_total_log_count(self): return self._cached_count("logs", "SELECT COUNT(id) FROM logs")
+    def get_qsl_count(self, direction): return self._cached_count(("qsl", direction), "SELECT COUNT(qsl_id) FROM qsl_cards WHERE direction = ?", (direction,))
+    DASHBOARD_COUNT_KEYS = ("logs", ("qsl", "TC"), ("qsl", "RC"))
+    def get_dashboard_counts(self):
+        """返回 (日志总数, 发卡数, 收卡数)：缓存失效后用一条语句同时取出三项，并写入各自的计数缓存。"""
+        cache = self._counts_cache()
+        if any(key not in cache for key in self.DASHBOARD_COUNT_KEYS):
+            cache.update(zip(self.DASHBOARD_COUNT_KEYS, self.fetch_one(
+                "SELECT (SELECT COUNT(id) FROM logs), (SELECT COUNT(qsl_id) FROM qsl_cards WHERE direction = 'TC'), (SELECT COUNT(qsl_id) FROM qsl_cards WHERE direction = 'RC')")))
+        return tuple(cache[key] for key in self.DASHBOARD_COUNT_KEYS)
+    def get_recent_qsl_activity(self, limit=10):
+        # 按 created_at 索引倒序取最近的卡片，每张卡只关联查一条日志的呼号，读到 limit 张即停止 (不再先 JOIN 全部链接再分组排序)
+        return self.fetch_all("""
+            SELECT q.direction, (SELECT l.station_callsign FROM qsl_log_link ql JOIN logs l ON l.id = ql.log_id WHERE ql.qsl_id = q.qsl_id LIMIT 1) AS station_callsign
+            FROM qsl_cards q
+            WHERE EXISTS (SELECT 1 FROM qsl_log_link ql JOIN logs l ON l.id = ql.log_id WHERE ql.qsl_id = q.qsl_id)
+            ORDER BY q.created_at DESC LIMIT ?""", (limit,))
+    SEARCH_COLUMNS = "l.id, l.my_callsign, l.station_callsign, l.qso_date, l.time_on, l.band, l.band_rx, l.freq, l.freq_rx, l.mode, l.qsl_sent, l.qsl_rcvd, l.comment"
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _search_sql(has_qsl_id, like_columns, use_fts, has_mode):
+        """按启用的筛选条件组合生成 search_logs 的 SQL。同一组合总是得到同一字符串，只拼接一次，且可命中语句缓存。"""
+        conditions = " WHERE 1=1"
+        if has_qsl_id:
+            # 用子查询取出匹配卡号关联的日志 ID (卡号前缀走 idx_cards_id_nocase)，不再 JOIN 后 DISTINCT 去重
+            conditions += " AND l.id IN (SELECT ql.log_id FROM qsl_cards q JOIN qsl_log_link ql ON ql.qsl_id = q.qsl_id WHERE q.qsl_id LIKE ?)"
+        for column in like_columns: conditions += f" AND l.{column} LIKE ?"
+        if use_fts: conditions += " AND l.id IN (SELECT rowid FROM logs_fts WHERE logs_fts MATCH ?)"
+        if has_mode: conditions += " AND l.mode = ?"
+        return f"SELECT {DatabaseManager.SEARCH_COLUMNS} FROM logs l" + conditions + " ORDER BY l.sort_id DESC"
     def search_logs(self, station_callsign=None, my_callsign=None, mode=None, qsl_id=None):
-        params = []; db_columns = ["l.id", "l.my_callsign", "l.station_callsign", "l.qso_date", "l.time_on", "l.band", "l.band_rx", "l.freq", "l.freq_rx", "l.mode", "l.qsl_sent", "l.qsl_rcvd", "l.comment"]
-        col_string = ", ".join(db_columns); base_query = f"SELECT DISTINCT {col_string} FROM logs l"; joins = ""; conditions = " WHERE 1=1"
-        if qsl_id and qsl_id.strip():
-            joins += " JOIN qsl_log_link ql ON l.id = ql.log_id JOIN qsl_cards q ON ql.qsl_id = q.qsl_id"
-            conditions += " AND UPPER(q.qsl_id) LIKE ?"
-            params.append(f"{qsl_id.strip().upper()}%")
-        if my_callsign and my_callsign.strip(): conditions += " AND l.my_callsign LIKE ?"; params.append(f"%{my_callsign.strip()}%")
-        if station_callsign and station_callsign.strip(): conditions += " AND l.station_callsign LIKE ?"; params.append(f"%{station_callsign.strip()}%")
-        if mode and mode != "全部模式": conditions += " AND l.mode = ?"; params.append(mode)
-        final_query = base_query + joins + conditions + " ORDER BY l.sort_id DESC"
-        return self.fetch_all(final_query, tuple(params))
+        params = []; like_columns = []; fts_terms = []
+        qsl_id = (qsl_id or "").strip()
+        if qsl_id: params.append(f"{qsl_id.upper()}%")
+        # 呼号子串匹配: 3 个字符及以上走 trigram 全文索引，更短的输入 (trigram 无法匹配) 仍用 LIKE
+        for column, text in (("my_callsign", my_callsign), ("station_callsign", station_callsign)):
+            text = (text or "").strip()
+            if not text: continue
+            if self.fts_enabled and len(text) >= 3: phrase = text.replace('"', '""'); fts_terms.append(f'{column} : "{phrase}"')
+            else: like_columns.append(column); params.append(f"%{text}%")
+        if fts_terms: params.append(" AND ".join(fts_terms))
+        has_mode = bool(mode and mode != "全部模式")
+        if has_mode: params.append(mode)
+        return self.fetch_all(self._search_sql(bool(qsl_id), tuple(like_columns), bool(fts_terms), has_mode), tuple(params))
     def log_exists(self, station_callsign, qso_date, time_on, band, mode):
         query = "SELECT id, time_on FROM logs WHERE UPPER(station_callsign)=? AND qso_date=? AND UPPER(band)=? AND UPPER(mode)=?"
         potential_duplicates = self.fetch_all(query, (station_callsign.upper(), qso_date, (band or "").upper(), (mode or "").upper()))
-        if not potential_duplicates: return None
-        try:
-            new_qso_time_obj = datetime.datetime.strptime(time_on.zfill(6), '%H%M%S')
-        except ValueError: return None
-        time_window = datetime.timedelta(minutes=5)
-        for row in potential_duplicates:
-            try:
-                existing_time_obj = datetime.datetime.strptime(row['time_on'].zfill(6), '%H%M%S')
-                if abs(new_qso_time_obj - existing_time_obj) <= time_window:
-                    return row['id']
-            except ValueError: continue
+        return self.match_time_window(potential_duplicates, time_on)
+    def find_logs_by_dup_keys(self, dup_keys):
+        """
+        批量查重：dup_keys 为 (呼号大写, 日期, 波段大写, 模式大写)，与 log_exists 的匹配条件一致。
+        按呼号分批 IN 查询 (走 idx_logs_dupkey 索引)，返回 {dup_key: [row, ...]}，每组按 id 排序。
+        """
+        dup_keys = set(dup_keys); callsigns = sorted({key[0] for key in dup_keys}); found = {}
+        upper = lambda value: value.upper() if value is not None else None # NULL 与 SQL 中一样不匹配任何值
+        for start in range(0, len(callsigns), 900):
+            chunk = callsigns[start:start + 900]
+            for row in self.fetch_all(f"SELECT * FROM logs WHERE UPPER(station_callsign) IN ({','.join('?' * len(chunk))}) ORDER BY id", chunk):
+                key = (upper(row['station_callsign']), row['qso_date'], upper(row['band']), upper(row['mode']))
+                if key in dup_keys: found.setdefault(key, []).append(row)
+        return found
+    @staticmethod
+    def match_time_window(candidates, time_on):
+        """在 candidates (含 'id' 与 'time_on') 中返回与 time_on 相差不超过 5 分钟的第一条的 id。"""
+        if not candidates: return None
+        # 整数秒比较，不再为每条候选创建 datetime 对象
+        new_seconds = DatabaseManager.time_on_seconds(time_on)
+        if new_seconds is None: return None
+        for row in candidates:
+            existing_seconds = DatabaseManager.time_on_seconds(row['time_on'])
+            if existing_seconds is not None and abs(new_seconds - existing_seconds) <= 300:
+                return row['id']
         return None
     def find_all_duplicates(self):
-        query = "SELECT station_callsign, qso_date, band, mode FROM logs GROUP BY UPPER(station_callsign), qso_date, UPPER(band), UPPER(mode) HAVING COUNT(id) > 1"
-        candidate_groups = self.fetch_all(query)
+        # 一次查询取出所有属于重复组的日志，按查重键与 time_on 排序 (走 idx_logs_dupkey)，分组在内存中完成
+        rows = self.fetch_all("""
+            SELECT id, time_on, UPPER(station_callsign) AS callsign_u, qso_date, UPPER(band) AS band_u, UPPER(mode) AS mode_u FROM logs
+            WHERE (UPPER(station_callsign), qso_date, UPPER(band), UPPER(mode)) IN (
+                SELECT UPPER(station_callsign), qso_date, UPPER(band), UPPER(mode) FROM logs
+                GROUP BY UPPER(station_callsign), qso_date, UPPER(band), UPPER(mode) HAVING COUNT(id) > 1)
+            ORDER BY UPPER(station_callsign), qso_date, UPPER(band), UPPER(mode), time_on""")
         duplicate_sets = []
-        time_window = datetime.timedelta(minutes=5)
-        for group in candidate_groups:
-            logs_in_group = self.fetch_all(
-                "SELECT id, time_on FROM logs WHERE UPPER(station_callsign)=? AND qso_date=? AND UPPER(band)=? AND UPPER(mode)=? ORDER BY time_on",
-                (group['station_callsign'].upper(), group['qso_date'], (group['band'] or "").upper(), (group['mode'] or "").upper())
-            )
-            if len(logs_in_group) < 2: continue
-
-            visited_indices = set()
-            for i in range(len(logs_in_group)):
-                if i in visited_indices: continue
-                current_set = {logs_in_group[i]['id']}
-                try: time_i = datetime.datetime.strptime(logs_in_group[i]['time_on'].zfill(6), '%H%M%S')
-                except (ValueError, AttributeError): continue
-
-                for j in range(i + 1, len(logs_in_group)):
-                    if j in visited_indices: continue
-                    try:
-                        time_j = datetime.datetime.strptime(logs_in_group[j]['time_on'].zfill(6), '%H%M%S')
-                        if abs(time_j - time_i) <= time_window:
-                            current_set.add(logs_in_group[j]['id']); visited_indices.add(j)
-                    except (ValueError, AttributeError): continue
-                if len(current_set) > 1:
-                    duplicate_sets.append(current_set)
+        for _, group in itertools.groupby(rows, key=lambda row: (row['callsign_u'], row['qso_date'], row['band_u'], row['mode_u'])):
+            # 每条日志的时间只解析一次 (整数秒)，无法解析的不参与查重
+            timed = sorted((seconds, row['id']) for row in group for seconds in (self.time_on_seconds(row['time_on']),) if seconds is not None)
+            # 按时间排序后，相邻两条相差不超过 5 分钟即属于同一组 (传递闭包)；间隔超过 5 分钟处断开
+            current_set = set()
+            for k, (seconds, log_id) in enumerate(timed):
+                if k and seconds - timed[k - 1][0] > 300:
+                    if len(current_set) > 1: duplicate_sets.append(current_set)
+                    current_set = set()
+                current_set.add(log_id)
+            if len(current_set) > 1: duplicate_sets.append(current_set)
         return duplicate_sets
+    @staticmethod
+    def time_on_seconds(time_on):
+        """把 time_on 转为当天的秒数，与 strptime(time_on.zfill(6), '%H%M%S') 的解析结果一致；无法解析时返回 None。"""
+        if time_on is None or len(time_on) > 6 or (time_on and not (time_on.isascii() and time_on.isdigit())): return None
+        digits = time_on.zfill(6); hours, minutes, seconds = int(digits[:2]), int(digits[2:4]), int(digits[4:])
+        if hours > 23 or minutes > 59 or seconds > 59: return None
+        return hours * 3600 + minutes * 60 + seconds
     def initialize_database(self):
         queries = [
             "CREATE TABLE IF NOT EXISTS callsigns (callsign TEXT PRIMARY KEY)",
@@ -2179,29 +2797,103 @@ class DatabaseManager:
         except sqlite3.OperationalError:
             self.execute_query("ALTER TABLE logs ADD COLUMN sort_id INTEGER")
             self.execute_query("UPDATE logs SET sort_id = id")
+        # 新日志未指定 sort_id 时默认等于 id (单条添加与批量导入共用，免去插入后的逐条 UPDATE)
+        self.execute_query("CREATE TRIGGER IF NOT EXISTS logs_default_sort_id AFTER INSERT ON logs WHEN new.sort_id IS NULL BEGIN UPDATE logs SET sort_id = new.id WHERE id = new.id; END")
+
+        # --- 新增: 常用查询的索引 ---
+        index_queries = [
+            "DROP INDEX IF EXISTS idx_logs_dup", # 旧版只含前两列，被 idx_logs_dupkey 覆盖
+            *self.LOG_INDEXES.values(),
+            "CREATE INDEX IF NOT EXISTS idx_link_log ON qsl_log_link(log_id)",     # 按日志查卡片 / 删除日志
+            # QSL 卡号前缀查找 (LIKE 'X%' 在 NOCASE 索引上可走范围查找)
+            "CREATE INDEX IF NOT EXISTS idx_cards_id_nocase ON qsl_cards(qsl_id COLLATE NOCASE)",
+            "CREATE INDEX IF NOT EXISTS idx_cards_dir_created ON qsl_cards(direction, created_at, qsl_id)",  # 生成下一个卡号
+            "CREATE INDEX IF NOT EXISTS idx_cards_created ON qsl_cards(created_at)",  # 首页最近卡片动态
+        ]
+        try:
+            for query in index_queries: self.cursor.execute(query)
+            self.conn.commit()
+        except sqlite3.Error as e: print(f"Index creation error: {e}"); self.conn.rollback()
+
+        self._init_callsign_fts()
+
+        # 已有较多日志但从未收集过统计信息 (旧数据库) 时执行一次 ANALYZE，之后由 close() 中的 PRAGMA optimize 维护
+        try:
+            if not self.fetch_one("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'") and self.fetch_one("SELECT COUNT(*) FROM logs")[0] > self.ANALYZE_MIN_ROWS:
+                self.cursor.execute("ANALYZE"); self.conn.commit()
+        except sqlite3.Error as e: print(f"Error analyzing database: {e}")
+
+    def _init_callsign_fts(self):
+        """
+        建立呼号全文索引 (FTS5 trigram，外部内容表指向 logs)，供 search_logs 做子串匹配时走倒排索引。
+        当前 SQLite 不支持 FTS5/trigram 时关闭该功能并移除同步触发器，search_logs 回退为 LIKE 扫描。
+        """
+        self.fts_enabled = False
+        try:
+            existed = self.fetch_one("SELECT 1 FROM sqlite_master WHERE name = 'logs_fts'")
+            self.cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(my_callsign, station_callsign, content='logs', content_rowid='id', tokenize='trigram')")
+            self.cursor.execute("CREATE TRIGGER IF NOT EXISTS logs_fts_ai AFTER INSERT ON logs BEGIN INSERT INTO logs_fts(rowid, my_callsign, station_callsign) VALUES (new.id, new.my_callsign, new.station_callsign); END")
+            self.cursor.execute("CREATE TRIGGER IF NOT EXISTS logs_fts_ad AFTER DELETE ON logs BEGIN INSERT INTO logs_fts(logs_fts, rowid, my_callsign, station_callsign) VALUES ('delete', old.id, old.my_callsign, old.station_callsign); END")
+            self.cursor.execute("CREATE TRIGGER IF NOT EXISTS logs_fts_au AFTER UPDATE OF my_callsign, station_callsign ON logs BEGIN INSERT INTO logs_fts(logs_fts, rowid, my_callsign, station_callsign) VALUES ('delete', old.id, old.my_callsign, old.station_callsign); INSERT INTO logs_fts(rowid, my_callsign, station_callsign) VALUES (new.id, new.my_callsign, new.station_callsign); END")
+            # 首次创建时为已有日志建立索引
+            if not existed: self.cursor.execute("INSERT INTO logs_fts(logs_fts) VALUES ('rebuild')")
+            self.conn.commit(); self.fts_enabled = True
+        except sqlite3.Error as e:
+            print(f"FTS5 unavailable, falling back to LIKE search: {e}"); self.conn.rollback()
+            # 触发器引用不存在的 logs_fts 会导致所有写入失败，必须移除
+            for trigger in ("logs_fts_ai", "logs_fts_ad", "logs_fts_au"): self.execute_query(f"DROP TRIGGER IF EXISTS {trigger}")
 
     def reorder_logs_by_time(self):
         try:
-            logs = self.fetch_all("SELECT id, qso_date, time_on FROM logs ORDER BY qso_date, time_on")
-            for new_index, log in enumerate(logs):
-                self.execute_query("UPDATE logs SET sort_id = ? WHERE id = ?", (new_index + 1, log['id']))
+            with self.transaction():
+                if sqlite3.sqlite_version_info >= (3, 33, 0):
+                    # 单条 UPDATE ... FROM：ROW_NUMBER() 在库内算出新序号，不必把全部日志取回 Python
+                    self.cursor.execute("UPDATE logs SET sort_id = ranked.rn FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY qso_date, time_on, id) AS rn FROM logs) AS ranked WHERE logs.id = ranked.id")
+                else:
+                    # 旧版 SQLite 不支持 UPDATE ... FROM，退回一次 executemany
+                    logs = self.fetch_all("SELECT id FROM logs ORDER BY qso_date, time_on, id")
+                    self.cursor.executemany("UPDATE logs SET sort_id = ? WHERE id = ?", ((new_index + 1, log['id']) for new_index, log in enumerate(logs)))
             return True
         except sqlite3.Error as e:
             print(f"Error reordering logs: {e}")
             return False
-    def delete_log(self, log_id):
-        self.execute_query("DELETE FROM qsl_log_link WHERE log_id = ?", (log_id,))
-        return self.execute_query("DELETE FROM logs WHERE id = ?", (log_id,))
+    # 以下多语句操作各自在一个事务内完成：只提交一次，任一步失败整体回滚
+    def merge_log_entries(self, updated_logs, deleted_log_ids):
+        """查重合并的批量写回：用 executemany 更新主日志 ({log_id: log_data})，再批量删除重复日志及其卡片关联。"""
+        deleted_log_ids = list(deleted_log_ids)
+        try:
+            with self.transaction():
+                self.cursor.executemany(self.LOG_UPDATE_QUERY, (dict(self._prepare_log_data(d), log_id=log_id) for log_id, d in updated_logs.items()))
+                self._delete_log_rows(deleted_log_ids)
+            return True
+        except sqlite3.Error as e: print(f"Error merging duplicate logs: {e}"); return False
+    def _delete_log_rows(self, log_ids):
+        """在当前事务内按 900 个一组删除日志及其卡片关联，返回实际删除的日志条数。"""
+        deleted_count = 0
+        for start in range(0, len(log_ids), 900):
+            chunk = log_ids[start:start + 900]; placeholders = ','.join('?' * len(chunk))
+            self.cursor.execute(f"DELETE FROM qsl_log_link WHERE log_id IN ({placeholders})", chunk)
+            self.cursor.execute(f"DELETE FROM logs WHERE id IN ({placeholders})", chunk); deleted_count += self.cursor.rowcount
+        return deleted_count
+    def delete_logs(self, log_ids):
+        """一个事务内批量删除多条日志，返回删除条数；出错 (已整体回滚) 时返回 0。"""
+        try:
+            with self.transaction(): return self._delete_log_rows(list(log_ids))
+        except sqlite3.Error as e: print(f"Error deleting logs: {e}"); return 0
+    def delete_log(self, log_id): return self.delete_logs([log_id]) > 0
     def recycle_qsl_card(self, log_id, direction):
         qsl_id_row = self.fetch_one("SELECT q.qsl_id FROM qsl_cards q JOIN qsl_log_link ql ON q.qsl_id = ql.qsl_id WHERE ql.log_id = ? AND q.direction = ?", (log_id, direction))
         if not qsl_id_row: return False
         qsl_id = qsl_id_row['qsl_id']
         status_field = "qsl_rcvd" if direction == 'RC' else "qsl_sent"
-        self.execute_query(f"UPDATE logs SET {status_field} = 'N' WHERE id = ?", (log_id,))
-        self.execute_query("DELETE FROM qsl_log_link WHERE qsl_id = ? AND log_id = ?", (qsl_id, log_id))
-        is_linked_elsewhere = self.fetch_one("SELECT 1 FROM qsl_log_link WHERE qsl_id = ?", (qsl_id,))
-        if not is_linked_elsewhere: self.execute_query("DELETE FROM qsl_cards WHERE qsl_id = ?", (qsl_id,))
-        return True
+        try:
+            with self.transaction():
+                self.cursor.execute(f"UPDATE logs SET {status_field} = 'N' WHERE id = ?", (log_id,))
+                self.cursor.execute("DELETE FROM qsl_log_link WHERE qsl_id = ? AND log_id = ?", (qsl_id, log_id))
+                is_linked_elsewhere = self.fetch_one("SELECT 1 FROM qsl_log_link WHERE qsl_id = ?", (qsl_id,))
+                if not is_linked_elsewhere: self.cursor.execute("DELETE FROM qsl_cards WHERE qsl_id = ?", (qsl_id,))
+            return True
+        except sqlite3.Error as e: print(f"Error recycling QSL card: {e}"); return False
     def update_qsl_card_date(self, qsl_id):
         """
         根据QSL ID查询关联的日志，并更新对应的收/发卡日期为当前日期。
@@ -2285,13 +2977,19 @@ class DatabaseManager:
     
     def reset_all_qsl_data(self):
         try:
-            self.execute_query("DELETE FROM qsl_log_link")
-            self.execute_query("DELETE FROM qsl_cards")
-            self.execute_query("UPDATE logs SET qsl_sent = 'N', qsl_rcvd = 'N'")
+            with self.transaction():
+                self.cursor.execute("DELETE FROM qsl_log_link")
+                self.cursor.execute("DELETE FROM qsl_cards")
+                self.cursor.execute("UPDATE logs SET qsl_sent = 'N', qsl_rcvd = 'N'")
             return True
-        except:
+        except sqlite3.Error as e:
+            print(f"Error resetting QSL data: {e}")
             return False
-    def close(self): self.conn.close(); print("Database connection closed.")
+    def close(self):
+        # 关闭前让 SQLite 按本次连接的查询情况更新需要的统计信息 (通常几乎不耗时)
+        try: self.cursor.execute("PRAGMA optimize")
+        except sqlite3.Error as e: print(f"Error optimizing database: {e}")
+        self.conn.close(); print("Database connection closed.")
 
 # --- QSL ID Generator ---
 class QSL_ID_Generator:
@@ -2303,36 +3001,16 @@ class QSL_ID_Generator:
             if last_year == current_year: return int(last_id[2:8]) + 1
         return 1
     @staticmethod
-    def generate(db_manager, id_type):
+    def generate(db_manager, id_type): return QSL_ID_Generator.generate_many(db_manager, id_type, 1)[0]
+    @staticmethod
+    def generate_many(db_manager, id_type, count):
+        """生成 count 个连续序号的卡号 (只查询一次当前序号)，供批量建卡在写入前一次分配。"""
         if id_type not in ['RC', 'TC']: raise ValueError("Type must be 'RC' or 'TC'")
         year = datetime.datetime.now().strftime('%y'); serial = QSL_ID_Generator.get_next_serial(db_manager, id_type)
-        random_hex = secrets.token_hex(8); return f"{year}{serial:06d}{id_type}{random_hex.upper()}"
-
-if __name__ == '__main__':
-    app = QApplication(sys.argv)
-
-    missing_libs = []
-    try: import adif_io
-    except ImportError: missing_libs.append('adif-io')
-    try: import qrcode
-    except ImportError: missing_libs.append('qrcode')
-    try: from reportlab.pdfgen import canvas
-    except ImportError: missing_libs.append('reportlab')
-    try: from PIL import Image
-    except ImportError: missing_libs.append('Pillow')
-    try: import fitz
-    except ImportError: missing_libs.append('PyMuPDF')
-    try: import serial
-    except ImportError: missing_libs.append('pyserial')
-
-
-    if missing_libs:
-        QMessageBox.critical(None, "缺少依赖库", f"检测到缺少以下必要的库:\n\n{', '.join(missing_libs)}\n\n请在终端中运行 'pip install --upgrade <library_name>' 来安装或更新它们。")
-        sys.exit(1)
+        return [f"{year}{serial + i:06d}{id_type}{secrets.token_hex(8).upper()}" for i in range(count)]
 
-    os.makedirs("assets", exist_ok=True)
-    with open(STYLE_SHEET_FILE, "w", encoding="utf-8") as f:
-        f.write("""
+# 全局样式表：作为常量直接应用，启动时不再写出 assets/style.qss 再读回
+STYLE_SHEET = """
     QMainWindow, QDialog, QWidget { background-color: #2c3e50; color: #ecf0f1; font-size: 26px; }
     QWidget#dashboard_view { background-color: #34495e; }
     QGroupBox { border: 1px solid #7f8c8d; border-radius: 5px; margin-top: 1ex; }
@@ -2356,7 +3034,20 @@ if __name__ == '__main__':
     QLabel#statsHeader { font-size: 16px; font-weight: bold; color: #3498db; margin-top: 10px; border: none; }
     QListWidget { border: none; }
     QSplitter::handle { background-color: #7f8c8d; }
-    """)
+    """
+
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
+
+    # 仅检查依赖是否已安装而不真正导入, 各库在首次使用时再加载
+    import importlib.util
+    missing_libs = [pip_name for module_name, pip_name in (("qrcode", "qrcode"), ("reportlab", "reportlab"), ("PIL", "Pillow"), ("fitz", "PyMuPDF"), ("serial", "pyserial"))
+                    if importlib.util.find_spec(module_name) is None]
+
+    if missing_libs:
+        QMessageBox.critical(None, "缺少依赖库", f"检测到缺少以下必要的库:\n\n{', '.join(missing_libs)}\n\n请在终端中运行 'pip install --upgrade <library_name>' 来安装或更新它们。")
+        sys.exit(1)
+
     main_win = MainWindow()
     main_win.showMaximized()
     app.exec()